@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Automatic points for chat activity
+"""
+
+from typing import Dict, Tuple
+
+
+class ActivityAccrual:
+    """In-memory accrual with per-user cooldown and daily cap.
+
+    record() runs for every message and only touches two dicts: the state
+    of the author (last award, UTC day, earned that day) and the pending
+    batch of the guild. drain() hands the batch over to be written to the
+    points store in one go.
+    """
+
+    def __init__(self, points: int, cooldown: float, daily_cap: int = 0):
+        self.points = points
+        self.cooldown = cooldown
+        self.daily_cap = daily_cap
+        # (guild_id, user_id) -> [last award, day, earned that day]
+        self.state: Dict[Tuple[int, int], list] = {}
+        self.pending: Dict[int, Dict[str, int]] = {}
+
+    def record(self, guild_id: int, user_id: int, now: float) -> bool:
+        """Учесть сообщение, True если начислены артефакты"""
+        key = (guild_id, user_id)
+        day = int(now // 86400)
+        state = self.state.get(key)
+        if state is None:
+            state = self.state[key] = [0.0, day, 0]
+        elif now - state[0] < self.cooldown:
+            return False
+        if state[1] != day:
+            state[1] = day
+            state[2] = 0
+
+        award = self.points
+        if self.daily_cap > 0:
+            award = min(award, self.daily_cap - state[2])
+            if award <= 0:
+                return False
+
+        state[0] = now
+        state[2] += award
+        batch = self.pending.get(guild_id)
+        if batch is None:
+            batch = self.pending[guild_id] = {}
+        user_id = str(user_id)
+        batch[user_id] = batch.get(user_id, 0) + award
+        return True
+
+    def drain(self) -> Dict[int, Dict[str, int]]:
+        """Забрать накопленное {guild_id: {user_id: артефакты}}"""
+        pending, self.pending = self.pending, {}
+        return pending
+
+    def prune(self, now: float):
+        """Забыть пользователей, не писавших со вчерашнего дня"""
+        day = int(now // 86400)
+        stale = [
+            key for key, state in self.state.items()
+            if state[1] < day and now - state[0] >= self.cooldown
+        ]
+        for key in stale:
+            del self.state[key]
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Offline benchmarks for the bot storage
+
+Usage: python3 bench.py [users] [commands]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import statistics
+
+from storage import PointsStore, GiveawayStore
+
+
+def make_points(users: int) -> dict:
+    return {
+        "users": {
+            str(10**17 + i): random.randint(0, 5000)
+            for i in range(users)
+        },
+        "role_rewards": {
+            str(10**18 + i): (i + 1) * 500
+            for i in range(5)
+        }
+    }
+
+
+def report(name: str, samples):
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"{name:<30} p50={statistics.median(samples) * 1000:8.3f}ms "
+          f"p99={p99 * 1000:8.3f}ms")
+
+
+def bench_points(users: int, commands: int):
+    """!add latency: load/save per command vs in-memory PointsStore"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "points.json")
+        with open(path, "w") as f:
+            json.dump(make_points(users), f, indent=2)
+
+        targets = [str(10**17 + random.randrange(users)) for _ in range(commands)]
+
+        # Old behaviour: load_points() + save_points() on every command
+        legacy = []
+        for user_id in targets:
+            start = time.perf_counter()
+            with open(path, "r") as f:
+                data = json.load(f)
+            data["users"][user_id] = data["users"].get(user_id, 0) + 10
+            with open(path, "w") as f:
+                json.dump(data, f, indent=2)
+            legacy.append(time.perf_counter() - start)
+
+        store = PointsStore(path)
+        start = time.perf_counter()
+        store.load()
+        load_time = time.perf_counter() - start
+
+        cached = []
+        for user_id in targets:
+            start = time.perf_counter()
+            store.add(user_id, 10)
+            cached.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        store.flush()
+        flush_time = time.perf_counter() - start
+
+    print(f"== points: {users} users, {commands} commands ==")
+    report("load/save per command", legacy)
+    report("PointsStore", cached)
+    print(f"{'PointsStore load (once)':<30} {load_time * 1000:8.3f}ms")
+    print(f"{'PointsStore flush (debounced)':<30} {flush_time * 1000:8.3f}ms")
+
+
+def make_giveaways(count: int, participants: int) -> dict:
+    return {
+        f"g{i:07d}": {
+            'id': f"g{i:07d}",
+            'channel_id': 1,
+            'message_id': i,
+            'prize': "Хабар",
+            'winners': 1,
+            'participants': [str(10**17 + j) for j in range(participants)],
+            'end_time': 0,
+            'ended': True,
+        }
+        for i in range(count)
+    }
+
+
+def bench_giveaways(count: int, participants: int, clicks: int):
+    """Join click: rewrite giveaways.json vs journal append"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "giveaways.json")
+        data = make_giveaways(count, participants)
+        data["live"] = {'id': "live", 'participants': [], 'ended': False}
+        with open(path, "w") as f:
+            json.dump(data, f)
+
+        # Old behaviour: save_data() after every click
+        legacy = []
+        for i in range(clicks):
+            start = time.perf_counter()
+            data["live"]['participants'].append(str(i))
+            with open(path + ".legacy", "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            legacy.append(time.perf_counter() - start)
+
+        store = GiveawayStore(path)
+        store.load()
+        journal = []
+        for i in range(clicks):
+            start = time.perf_counter()
+            store.join("live", str(i))
+            journal.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        store.compact()
+        compact_time = time.perf_counter() - start
+        store.close()
+
+    print(f"== giveaways: {count} x {participants} participants, "
+          f"{clicks} clicks ==")
+    report("save_data per click", legacy)
+    report("journal append", journal)
+    print(f"{'compaction (background)':<30} {compact_time * 1000:8.3f}ms")
+
+
+if __name__ == "__main__":
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    commands = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    bench_points(users, commands)
+    bench_giveaways(200, 500, commands)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+In-memory indexes over points data
+"""
+
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+class LeaderboardIndex:
+    """Users ordered by points, highest first.
+
+    Keys are (-points, user_id) tuples kept in a bucketed sorted list
+    (small sorted lists of at most 2 * load keys plus a list of bucket
+    maxima), so updates bisect to the right bucket and only shift that
+    bucket instead of the whole board. Ties are broken by user ID.
+
+    The index does not own the balances: callers pass the previous value
+    on update, so the points dict of the store is not duplicated.
+    """
+
+    def __init__(self, items: Iterable[Tuple[str, int]] = (), load: int = 512):
+        self.load = load
+        self.size = 0
+        self._buckets: List[List[tuple]] = []
+        self._maxes: List[tuple] = []
+        self.rebuild(items)
+
+    @staticmethod
+    def _key(user_id: str, points: int) -> tuple:
+        return (-points, int(user_id))
+
+    def rebuild(self, items: Iterable[Tuple[str, int]]):
+        keys = sorted(self._key(uid, points) for uid, points in items)
+        self.size = len(keys)
+        self._buckets = [
+            keys[i:i + self.load] for i in range(0, len(keys), self.load)
+        ]
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+
+    def __len__(self) -> int:
+        return self.size
+
+    # --- updates ---
+    def update(self, user_id: str, old: Optional[int], points: int):
+        """Перенести пользователя с old очков (None - новый) на points"""
+        if old == points:
+            return
+        if old is not None:
+            self._remove(self._key(user_id, old))
+        self._insert(self._key(user_id, points))
+
+    def discard(self, user_id: str, points: int):
+        self._remove(self._key(user_id, points))
+
+    def _insert(self, key: tuple):
+        self.size += 1
+        if not self._buckets:
+            self._buckets.append([key])
+            self._maxes.append(key)
+            return
+        pos = bisect_left(self._maxes, key)
+        if pos == len(self._buckets):
+            pos -= 1
+        bucket = self._buckets[pos]
+        insort(bucket, key)
+        self._maxes[pos] = bucket[-1]
+        if len(bucket) > 2 * self.load:
+            self._buckets.insert(pos + 1, bucket[self.load:])
+            del bucket[self.load:]
+            self._maxes[pos] = bucket[-1]
+            self._maxes.insert(pos + 1, self._buckets[pos + 1][-1])
+
+    def _remove(self, key: tuple):
+        self.size -= 1
+        pos = bisect_left(self._maxes, key)
+        bucket = self._buckets[pos]
+        del bucket[bisect_left(bucket, key)]
+        if bucket:
+            self._maxes[pos] = bucket[-1]
+        else:
+            del self._buckets[pos]
+            del self._maxes[pos]
+
+    # --- queries ---
+    def top(self, limit: int = 10, offset: int = 0) -> List[Tuple[str, int]]:
+        """Срез рейтинга [offset, offset + limit)"""
+        result = []
+        skip = offset
+        for bucket in self._buckets:
+            if skip >= len(bucket):
+                skip -= len(bucket)
+                continue
+            for neg_points, user_id in bucket[skip:]:
+                result.append((str(user_id), -neg_points))
+                if len(result) >= limit:
+                    return result
+            skip = 0
+        return result
+
+    def rank(self, user_id: str, points: int) -> int:
+        """Место пользователя с points очками (с 1)"""
+        key = self._key(user_id, points)
+        pos = bisect_left(self._maxes, key)
+        before = sum(len(bucket) for bucket in self._buckets[:pos])
+        return before + bisect_left(self._buckets[pos], key) + 1
+
+
+class ThresholdIndex:
+    """Role rewards sorted by threshold.
+
+    The roles a balance qualifies for are a prefix of the sorted list, found
+    with one bisect; diff() turns that into the minimal set of roles to add
+    and remove for a member.
+    """
+
+    def __init__(self, rewards: Dict[str, int] = None):
+        self.rebuild(rewards or {})
+
+    def rebuild(self, rewards: Dict[str, int]):
+        entries = sorted((int(threshold), int(role_id))
+                         for role_id, threshold in rewards.items())
+        self.thresholds = [threshold for threshold, _ in entries]
+        self.role_ids = [role_id for _, role_id in entries]
+        self.managed: Set[int] = set(self.role_ids)
+
+    def __len__(self) -> int:
+        return len(self.role_ids)
+
+    def __iter__(self):
+        return iter(zip(self.role_ids, self.thresholds))
+
+    def qualified(self, points: int) -> List[int]:
+        """Роли, положенные за points артефактов"""
+        return self.role_ids[:bisect_right(self.thresholds, points)]
+
+    def crossed(self, old: int, points: int) -> bool:
+        """Изменился ли набор положенных ролей (пересечен ли порог)"""
+        return (bisect_right(self.thresholds, old) !=
+                bisect_right(self.thresholds, points))
+
+    def diff(self, held: Set[int], points: int) -> Tuple[Set[int], Set[int]]:
+        """(выдать, снять) для участника с ролями held"""
+        wanted = set(self.qualified(points))
+        return wanted - held, (self.managed - wanted) & held
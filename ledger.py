@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Points ledger: append-only history of points changes and rolling
+per-window leaderboards (day / week / month)
+"""
+
+import os
+import json
+import time
+import sqlite3
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from indexes import LeaderboardIndex
+from metrics import PERSIST_BYTES, PERSIST_SECONDS
+
+DEFAULT_WINDOWS = {"day": 86400, "week": 7 * 86400, "month": 30 * 86400}
+
+
+class WindowedTotals:
+    """Per-user sums of ledger deltas over the last span seconds.
+
+    Deltas are grouped into buckets of `resolution` seconds shared by all
+    windows. A new entry is added to the totals right away; when the oldest
+    bucket leaves the window its sums are subtracted as a whole, so the
+    window never rescans the ledger. The ranking lives in a
+    LeaderboardIndex like the all-time board.
+    """
+
+    def __init__(self, span: int):
+        self.span = span
+        self.totals: Dict[str, int] = {}
+        self.leaderboard = LeaderboardIndex()
+        self.buckets: Deque[Tuple[int, Dict[str, int]]] = deque()
+
+    def _change(self, user_id: str, delta: int):
+        old = self.totals.get(user_id)
+        total = (old or 0) + delta
+        if total:
+            self.leaderboard.update(user_id, old, total)
+            self.totals[user_id] = total
+        elif old is not None:
+            self.leaderboard.discard(user_id, old)
+            del self.totals[user_id]
+
+    def add(self, user_id: str, delta: int):
+        self._change(user_id, delta)
+
+    def expire(self, now: float, resolution: int):
+        cutoff = now - self.span
+        while self.buckets and self.buckets[0][0] + resolution <= cutoff:
+            _, bucket = self.buckets.popleft()
+            for user_id, delta in bucket.items():
+                self._change(user_id, -delta)
+
+    def get(self, user_id: str) -> int:
+        return self.totals.get(user_id, 0)
+
+    def top(self, limit: int = 10, offset: int = 0) -> List[Tuple[str, int]]:
+        return self.leaderboard.top(limit, offset)
+
+
+class PointsLedger:
+    """Append-only ledger of one guild, one JSONL file per month.
+
+    Only the files that overlap the longest window are read on load, so
+    startup does not depend on how long the history is.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 windows: Optional[Dict[str, int]] = None,
+                 resolution: int = 3600):
+        self.directory = directory
+        self.resolution = resolution
+        self.windows: Dict[str, WindowedTotals] = {
+            name: WindowedTotals(span)
+            for name, span in (windows or DEFAULT_WINDOWS).items()
+        }
+        self.span = max((w.span for w in self.windows.values()), default=0)
+        self._bucket: Optional[Tuple[int, Dict[str, int]]] = None
+        self._file = None
+        self._file_month: Optional[str] = None
+
+    # --- storage ---
+    @staticmethod
+    def _month(ts: float) -> str:
+        return time.strftime("%Y-%m", time.gmtime(ts))
+
+    def _path(self, month: str) -> str:
+        return os.path.join(self.directory, f"{month}.jsonl")
+
+    def _read(self, since: float) -> Iterable[dict]:
+        if not os.path.isdir(self.directory):
+            return
+        first = self._path(self._month(since))
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if not name.endswith(".jsonl") or path < first:
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Torn last line after a crash
+                        continue
+                    if entry.get("ts", 0) >= since:
+                        yield entry
+
+    def _write(self, entries: List[dict]):
+        month = self._month(entries[0]["ts"])
+        if self._file is None or self._file_month != month:
+            self.close()
+            os.makedirs(self.directory, exist_ok=True)
+            self._file = open(self._path(month), "a", encoding="utf-8")
+            self._file_month = month
+        payload = "".join(
+            json.dumps(entry, ensure_ascii=False, separators=(",", ":")) +
+            "\n" for entry in entries)
+        self._file.write(payload)
+        self._file.flush()
+        PERSIST_BYTES.inc(len(payload), op="ledger_append")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # --- aggregates ---
+    def load(self):
+        for window in self.windows.values():
+            window.totals.clear()
+            window.leaderboard.rebuild(())
+            window.buckets.clear()
+        self._bucket = None
+
+        now = time.time()
+        for entry in self._read(now - self.span):
+            self._aggregate(entry["target"], entry["delta"], entry["ts"])
+        self.expire(now)
+
+    def _aggregate(self, user_id: str, delta: int, ts: float):
+        start = int(ts) // self.resolution * self.resolution
+        if self._bucket is None or start > self._bucket[0]:
+            self._bucket = (start, {})
+            for window in self.windows.values():
+                window.buckets.append(self._bucket)
+        # Late entries (clock changes) count towards the newest bucket
+        bucket = self._bucket[1]
+        bucket[user_id] = bucket.get(user_id, 0) + delta
+        for window in self.windows.values():
+            window.add(user_id, delta)
+
+    def expire(self, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        for window in self.windows.values():
+            window.expire(now, self.resolution)
+
+    # --- writes ---
+    def record(self,
+               actor: Optional[str],
+               changes: Dict[str, int],
+               reason: str,
+               ts: Optional[float] = None):
+        """Записать изменения {получатель: дельта} одного действия"""
+        ts = int(time.time() if ts is None else ts)
+        entries = [{
+            "ts": ts,
+            "actor": actor,
+            "target": user_id,
+            "delta": int(delta),
+            "reason": reason
+        } for user_id, delta in changes.items() if delta]
+        if not entries:
+            return
+        try:
+            with PERSIST_SECONDS.time(op="ledger_append"):
+                self._write(entries)
+        except Exception as e:
+            print(f"Error saving ledger: {e}")
+        for entry in entries:
+            self._aggregate(entry["target"], entry["delta"], ts)
+        self.expire(ts)
+
+    # --- reads ---
+    def window(self, name: str) -> WindowedTotals:
+        window = self.windows[name]
+        window.expire(time.time(), self.resolution)
+        return window
+
+
+class SqlitePointsLedger(PointsLedger):
+    """Ledger rows in the guild database (ledger table)"""
+
+    def __init__(self,
+                 conn: sqlite3.Connection,
+                 windows: Optional[Dict[str, int]] = None,
+                 resolution: int = 3600):
+        super().__init__("", windows, resolution)
+        self.conn = conn
+
+    def _read(self, since: float) -> Iterable[dict]:
+        for ts, actor, target, delta, reason in self.conn.execute(
+                "SELECT ts, actor, target, delta, reason FROM ledger "
+                "WHERE ts >= ? ORDER BY id", (int(since), )):
+            yield {
+                "ts": ts,
+                "actor": actor,
+                "target": target,
+                "delta": delta,
+                "reason": reason
+            }
+
+    def _write(self, entries: List[dict]):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "INSERT INTO ledger (ts, actor, target, delta, reason) "
+                "VALUES (:ts, :actor, :target, :delta, :reason)", entries)
+
+    def close(self):
+        pass
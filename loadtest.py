@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Offline load test: drives the real handlers of main.py with fake Discord
+objects (interactions, channels, messages) instead of a gateway connection
+
+Usage: python3 loadtest.py [--joins N] [--join-rate N] [--ends N]
+                           [--participants N] [--users N] [--queries N]
+                           [--http-latency MS] [--outbox-rate N]
+"""
+
+import io
+import os
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import statistics
+import contextlib
+from typing import List, Optional
+
+import discord
+
+# main.py reads its configuration at import time
+DATA_DIR = tempfile.mkdtemp(prefix="loadtest-")
+os.environ.setdefault("TOKEN", "loadtest")
+os.environ["DATA_DIR"] = DATA_DIR
+
+import main  # noqa: E402
+
+GUILD_ID = 10**17
+CHANNEL_ID = 10**17 + 1
+# Outbox rate when --outbox-rate is not given
+UNTHROTTLED = 1e9
+
+
+# ---------------- Fake Discord ----------------
+class FakeHTTP:
+    """Simulated REST round trips, counted per route"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = {}
+
+    async def request(self, route: str):
+        self.calls[route] = self.calls.get(route, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+
+class FakeMessage:
+
+    def __init__(self, http: FakeHTTP, message_id: int):
+        self.http = http
+        self.id = message_id
+
+    async def edit(self, **kwargs):
+        await self.http.request("edit_message")
+        return self
+
+    async def delete(self):
+        await self.http.request("delete_message")
+
+
+class FakeChannel:
+
+    def __init__(self, http: FakeHTTP):
+        self.http = http
+        self.id = CHANNEL_ID
+        self.next_id = 1
+
+    def get_partial_message(self, message_id: int) -> FakeMessage:
+        return FakeMessage(self.http, message_id)
+
+    async def fetch_message(self, message_id: int) -> FakeMessage:
+        await self.http.request("fetch_message")
+        return FakeMessage(self.http, message_id)
+
+    async def send(self, *args, **kwargs) -> FakeMessage:
+        await self.http.request("send_message")
+        self.next_id += 1
+        return FakeMessage(self.http, self.next_id)
+
+
+class FakeUser:
+
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.bot = False
+        self.display_name = f"stalker{user_id}"
+        self.mention = f"<@{user_id}>"
+
+
+class FakeResponse:
+
+    def __init__(self, http: FakeHTTP):
+        self.http = http
+
+    async def send_message(self, *args, **kwargs):
+        await self.http.request("interaction_response")
+
+    async def edit_message(self, *args, **kwargs):
+        await self.http.request("interaction_response")
+
+
+class FakeInteraction:
+
+    type = discord.InteractionType.component
+
+    def __init__(self, http: FakeHTTP, user_id: int, custom_id: str):
+        self.user = FakeUser(user_id)
+        self.guild_id = GUILD_ID
+        self.data = {"custom_id": custom_id}
+        self.response = FakeResponse(http)
+
+
+class FakeGuild:
+
+    def __init__(self):
+        self.id = GUILD_ID
+
+    def get_member(self, user_id: int):
+        return None
+
+    def get_role(self, role_id: int):
+        return None
+
+
+class FakeContext:
+
+    def __init__(self, channel: FakeChannel, guild: FakeGuild):
+        self.channel = channel
+        self.guild = guild
+        self.author = FakeUser(GUILD_ID + 2)
+
+    async def send(self, *args, **kwargs):
+        return await self.channel.send()
+
+
+def install_fakes(http: FakeHTTP) -> FakeChannel:
+    channel = FakeChannel(http)
+    main.bot.get_channel = lambda channel_id: channel
+    main.bot.get_partial_messageable = lambda channel_id: channel
+    return channel
+
+
+# ---------------- Measurements ----------------
+class LoopMonitor:
+    """Event loop lag: how late a short sleep wakes up"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lags: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.lags = []
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        self._task.cancel()
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(
+                max(0.0, time.perf_counter() - start - self.interval))
+
+
+def written_bytes() -> Optional[int]:
+    """Байты, записанные процессом (Linux /proc), или None"""
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def percentile(samples: List[float], q: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+class Workload:
+    """Collects latencies of one workload and prints a summary"""
+
+    def __init__(self, name: str, http: FakeHTTP):
+        self.name = name
+        self.http = http
+        self.samples: List[float] = []
+        self.elapsed: Optional[float] = None
+        self.monitor = LoopMonitor()
+
+    def __enter__(self):
+        self.calls = dict(self.http.calls)
+        self.bytes = written_bytes()
+        self.started = time.perf_counter()
+        self.monitor.start()
+        return self
+
+    def done(self, elapsed: Optional[float] = None):
+        """Зафиксировать время операций (до хвостовых фоновых задач)"""
+        if elapsed is None:
+            elapsed = time.perf_counter() - self.started
+        self.elapsed = elapsed
+
+    def __exit__(self, *exc):
+        if self.elapsed is None:
+            self.done()
+        self.monitor.stop()
+        if self.bytes is not None:
+            self.bytes = written_bytes() - self.bytes
+        # Before later workloads of the same group add their calls
+        self.calls = {
+            route: count - self.calls.get(route, 0)
+            for route, count in self.http.calls.items()
+            if count != self.calls.get(route, 0)
+        }
+
+    def report(self):
+        print(f"== {self.name} ==")
+        if self.samples:
+            print(f"  ops {len(self.samples)} in {self.elapsed:.2f}s "
+                  f"({len(self.samples) / self.elapsed:.0f}/s)")
+            print(f"  latency p50={statistics.median(self.samples) * 1000:.2f}ms"
+                  f" p99={percentile(self.samples, 0.99) * 1000:.2f}ms"
+                  f" max={max(self.samples) * 1000:.2f}ms")
+        lags = self.monitor.lags or [0.0]
+        print(f"  loop lag p99={percentile(lags, 0.99) * 1000:.2f}ms"
+              f" max={max(lags) * 1000:.2f}ms"
+              f" blocked={sum(lags) * 1000:.0f}ms")
+        print(f"  discord calls {self.calls}")
+        if self.bytes is not None:
+            print(f"  bytes written {self.bytes}")
+
+
+def create_giveaway(data, giveaway_id: str, end_time: float,
+                    participants: int = 0):
+    data.giveaway_store.create(
+        giveaway_id, {
+            'id': giveaway_id,
+            'channel_id': CHANNEL_ID,
+            'message_id': random.randrange(1, 2**40),
+            'creator_id': str(GUILD_ID + 2),
+            'prize': "Хабар",
+            'winners': 3,
+            'participants': [
+                str(GUILD_ID + 10 + i) for i in range(participants)
+            ],
+            'end_time': int(end_time),
+            'ended': False,
+            'flavor': main.pick_flavor(),
+            'host_name': "loadtest"
+        })
+
+
+# ---------------- Workloads ----------------
+async def run_joins(http: FakeHTTP, joins: int, rate: float):
+    """joins кликов «Участвовать» по одному розыгрышу, rate в минуту"""
+    data = main.guild_registry.get(GUILD_ID)
+    create_giveaway(data, "joins", time.time() + 86400)
+
+    async def click(user_id: int, samples: List[float]):
+        start = time.perf_counter()
+        await main.dispatch_giveaway_button(
+            FakeInteraction(http, user_id, "join_joins"))
+        samples.append(time.perf_counter() - start)
+
+    with Workload(f"joins: {joins} at {rate or 'max'}/min", http) as w:
+        tasks = []
+        for i in range(joins):
+            tasks.append(asyncio.create_task(click(GUILD_ID + 10 + i,
+                                                   w.samples)))
+            if rate:
+                await asyncio.sleep(60 / rate)
+        await asyncio.gather(*tasks)
+        w.done()
+        # Let the coalesced embed edit go out
+        await asyncio.sleep(main.EMBED_REFRESH_INTERVAL + 0.1)
+
+    with Workload("compaction (save_data)", http) as compaction:
+        start = time.perf_counter()
+        await data.giveaway_store.compact_async()
+        compaction.samples.append(time.perf_counter() - start)
+    return [w, compaction]
+
+
+async def drain_outbox():
+    """Дождаться, пока воркеры outbox отправят все"""
+    workers = [
+        lane.task for channel in main.outbox.channels.values()
+        for lane in channel.lanes() if lane.task is not None
+    ]
+    await asyncio.gather(*workers)
+
+
+async def run_ends(http: FakeHTTP, count: int, participants: int):
+    """count розыгрышей с одинаковым end_time"""
+    data = main.guild_registry.get(GUILD_ID)
+    # Whole seconds, like end_time of real giveaways
+    deadline = int(time.time()) + 2
+    for i in range(count):
+        create_giveaway(data, f"end{i}", deadline, participants)
+
+    done = asyncio.Event()
+    remaining = [count]
+    end_giveaway = main.end_giveaway
+
+    async def timed_end(guild_data, giveaway_id):
+        await end_giveaway(guild_data, giveaway_id)
+        w.samples.append(time.time() - deadline)
+        remaining[0] -= 1
+        if not remaining[0]:
+            done.set()
+
+    # Every end queues an edit and an announcement in the same channel
+    timeout = 60 + count + count / main.outbox.rate
+    main.end_giveaway = timed_end
+    try:
+        with Workload(f"ends: {count} x {participants} participants",
+                      http) as w:
+            main.schedule_giveaways(data)
+            await asyncio.wait_for(done.wait(), timeout=timeout)
+            w.done(max(w.samples))
+            # Ends don't wait for delivery, count it in this workload
+            await asyncio.wait_for(drain_outbox(), timeout=timeout)
+    finally:
+        main.end_giveaway = end_giveaway
+    return [w]
+
+
+async def run_leaderboard(http: FakeHTTP, channel: FakeChannel, users: int,
+                          queries: int):
+    """!top и !rank на рейтинге из users сталкеров"""
+    points = main.guild_registry.get(GUILD_ID).points
+    points.add_many({
+        str(GUILD_ID + 10 + i): random.randint(0, 100000)
+        for i in range(users)
+    })
+
+    ctx = FakeContext(channel, FakeGuild())
+    pages = main.leaderboard_pages(points)
+
+    with Workload(f"!top: {users} users, {queries} queries", http) as top:
+        for _ in range(queries):
+            start = time.perf_counter()
+            await main.top.callback(ctx, str(random.randint(1, pages)))
+            top.samples.append(time.perf_counter() - start)
+
+    with Workload(f"!rank: {users} users, {queries} queries", http) as rank:
+        for _ in range(queries):
+            member = FakeUser(GUILD_ID + 10 + random.randrange(users))
+            start = time.perf_counter()
+            await main.rank.callback(ctx, member)
+            rank.samples.append(time.perf_counter() - start)
+
+    with Workload("points flush", http) as flush:
+        start = time.perf_counter()
+        await points.flush_async()
+        flush.samples.append(time.perf_counter() - start)
+    return [top, rank, flush]
+
+
+async def run(args):
+    http = FakeHTTP(args.http_latency / 1000)
+    channel = install_fakes(http)
+    # Unthrottled unless asked for: at the bot's default of 1 message per
+    # second the outbox, not the code under test, would dominate
+    main.outbox.rate = args.outbox_rate or UNTHROTTLED
+    main.guild_registry.start()
+    main.giveaway_scheduler.start()
+
+    for workload in (run_joins(http, args.joins, args.join_rate),
+                     run_ends(http, args.ends, args.participants),
+                     run_leaderboard(http, channel, args.users,
+                                     args.queries)):
+        # Handlers print per event; keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = await workload
+        for w in results:
+            w.report()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--joins", type=int, default=1000)
+    parser.add_argument("--join-rate", type=float, default=5000,
+                        help="joins per minute, 0 = as fast as possible")
+    parser.add_argument("--ends", type=int, default=100)
+    parser.add_argument("--participants", type=int, default=500)
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--http-latency", type=float, default=50,
+                        help="simulated Discord round trip, ms")
+    parser.add_argument("--outbox-rate", type=float, default=0,
+                        help="messages per second per channel,"
+                        " 0 = unthrottled")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(run(args))
+    finally:
+        with contextlib.redirect_stdout(io.StringIO()):
+            main.save_data()
+        shutil.rmtree(DATA_DIR, ignore_errors=True)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Points-weighted giveaway entries
+"""
+
+import math
+import heapq
+import random
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Entry weight = base + curve(min(points, cap))
+CURVES: Dict[str, Callable[[float], float]] = {
+    "linear": lambda points: points,
+    "sqrt": math.sqrt,
+    "log": math.log1p,
+}
+
+
+def entry_weight(points: int, curve: str, cap: int = 0,
+                 base: float = 1.0) -> float:
+    """Вес участника с points артефактов (base - шанс у новичков)"""
+    points = max(0, points)
+    if cap > 0:
+        points = min(points, cap)
+    return base + CURVES[curve](points)
+
+
+def weighted_sample(entries: Iterable[Tuple[int, float]],
+                    count: int) -> List[int]:
+    """count победителей без повторов, шанс пропорционален весу.
+
+    Efraimidis-Spirakis (A-Res): each entry gets the key log(u) / weight
+    and the count largest keys win. Only a min-heap of count keys is kept,
+    so a draw is O(n log k) time and O(k) memory.
+    """
+    if count <= 0:
+        return []
+    heap: List[Tuple[float, int]] = []
+    for uid, weight in entries:
+        if weight <= 0:
+            continue
+        # 1 - random() is in (0, 1], log() is defined
+        key = math.log(1.0 - random.random()) / weight
+        if len(heap) < count:
+            heapq.heappush(heap, (key, uid))
+        elif key > heap[0][0]:
+            heapq.heapreplace(heap, (key, uid))
+    return [uid for _, uid in sorted(heap, reverse=True)]
+
+
+class WeightedEntries:
+    """Entry weights of one giveaway with a running total.
+
+    Joins, leaves and balance changes adjust the total in O(1), so the
+    chance of one entrant is available without a pass over all of them.
+    """
+
+    def __init__(self, weight: Callable[[int], float]):
+        self.weight = weight
+        self.weights: Dict[int, float] = {}
+        self.total = 0.0
+
+    def __len__(self) -> int:
+        return len(self.weights)
+
+    def __contains__(self, uid) -> bool:
+        return int(uid) in self.weights
+
+    def set(self, uid, points: int):
+        uid = int(uid)
+        weight = self.weight(points)
+        self.total += weight - self.weights.get(uid, 0.0)
+        self.weights[uid] = weight
+
+    def update(self, uid, points: int):
+        """Новый баланс участника (не участник - ничего не делаем)"""
+        if int(uid) in self.weights:
+            self.set(uid, points)
+
+    def discard(self, uid):
+        weight = self.weights.pop(int(uid), None)
+        if weight is not None:
+            self.total -= weight
+        if not self.weights:
+            # Do not carry float drift into an empty pool
+            self.total = 0.0
+
+    def chance(self, uid, count: int, points: int = 0) -> float:
+        """Шанс попасть в count победителей (0..1).
+
+        Exact for one winner (weight / total); for more winners the first
+        order inclusion probability count * weight / total, capped at 1.
+        Entrants that have not joined yet are counted as if they had.
+        """
+        uid = int(uid)
+        total = self.total
+        weight = self.weights.get(uid)
+        if weight is None:
+            weight = self.weight(points)
+            total += weight
+        if total <= 0 or count <= 0:
+            return 0.0
+        if count >= len(self.weights) + (uid not in self.weights):
+            return 1.0
+        return min(1.0, count * weight / total)
@@ -5,33 +5,48 @@ Discord Giveaway Bot with Prefix Commands Only
 """
 
 import os
+import re
+import csv
+import glob
 import json
 import time
 import uuid
 import random
+import signal
 import asyncio
-from typing import Dict, List
+import functools
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+from zoneinfo import ZoneInfo
 
 import discord
 from discord.ext import commands
 from discord.ui import View, Button
 
+import metrics
+from activity import ActivityAccrual
+from voice import VoiceTracker
+from members import MemberCache
+from lottery import CURVES, WeightedEntries, entry_weight, weighted_sample
+from requirements import EntryRequirements
+from metrics import (COMMAND_ERRORS, COMMAND_SECONDS, DISCORD_ERRORS,
+                     DISCORD_SECONDS, INTERACTION_ERRORS, INTERACTION_SECONDS,
+                     LOOP_LAG, OUTBOX_DROPPED, OUTBOX_WAIT,
+                     PERSIST_SECONDS, STARTUP_SECONDS)
+from outbox import LOW, NORMAL, URGENT, Outbox
+from recurring import next_start, parse_when
+from rolesync import RoleSyncJob, TokenBucket
+from scheduler import DeadlineScheduler
+from storage import (GuildData, GuildRegistry, dump_compact, has_flat_data,
+                     migrate_flat_data, participants_of)
+
 # --- Create persistent data directory on Render ---
-DATA_DIR = "/opt/render/project/data"
+DATA_DIR = os.getenv("DATA_DIR", "/opt/render/project/data")
 os.makedirs(DATA_DIR, exist_ok=True)
 
 
-DATA_FILE = os.path.join(DATA_DIR, "giveaways.json")
-POINTS_FILE = os.path.join(DATA_DIR, "points.json")
-
-# Create files if missing
-def ensure_file(path, default_data):
-    if not os.path.exists(path):
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(default_data, f, ensure_ascii=False, indent=4)
-
-ensure_file(DATA_FILE, {})
-ensure_file(POINTS_FILE, {})
+# "json" (files) or "sqlite" (see migrate.py for the import)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
 
 # Configuration
 TOKEN = os.getenv("TOKEN")
@@ -40,79 +55,393 @@ if not TOKEN:
     print("💡 Command: export TOKEN=your_bot_token_here")
     exit(1)
 
-# Load data
-def load_data():
-    global giveaways
-    try:
-        if os.path.exists(DATA_FILE):
-            with open(DATA_FILE, "r", encoding="utf-8") as f:
-                giveaways = json.load(f)
-        else:
-            giveaways = {}
-    except Exception as e:
-        print(f"Error loading data: {e}")
-        giveaways = {}
-
+# Storage: giveaways as snapshot + append-only journal, points loaded once
+# and flushed in the background (or both in SQLite)
+GIVEAWAY_COMPACT_INTERVAL = float(os.getenv("GIVEAWAY_COMPACT_INTERVAL",
+                                            "300"))
+POINTS_FLUSH_INTERVAL = float(os.getenv("POINTS_FLUSH_INTERVAL", "5"))
+
+# Rolling leaderboards over the points ledger: "name=seconds,..."
+LEDGER_WINDOWS = {
+    name.strip(): int(seconds)
+    for name, seconds in (
+        item.split("=") for item in os.getenv(
+            "LEDGER_WINDOWS", "day=86400,week=604800,month=2592000").split(",")
+        if item.strip())
+}
+LEDGER_WINDOW_TITLES = {"day": "за день", "week": "за неделю",
+                        "month": "за месяц"}
+
+# Every guild has its own data in DATA_DIR/guilds/<guild_id>, loaded on
+# first use
+guild_registry = GuildRegistry(os.path.join(DATA_DIR, "guilds"),
+                               backend=STORAGE_BACKEND,
+                               flush_interval=POINTS_FLUSH_INTERVAL,
+                               compact_interval=GIVEAWAY_COMPACT_INTERVAL,
+                               ledger_windows=LEDGER_WINDOWS)
+
+# Data of the old single-guild layout (DATA_DIR/points.json, ...) is moved
+# to the guild LEGACY_GUILD_ID on start, see also migrate.py. Without it the
+# bot does not start: it would run on empty data next to the old one
+LEGACY_GUILD_ID = os.getenv("LEGACY_GUILD_ID")
+if has_flat_data(DATA_DIR):
+    if not LEGACY_GUILD_ID:
+        raise SystemExit("❌ Найдены данные старого формата в DATA_DIR, "
+                         "укажите LEGACY_GUILD_ID для переноса")
+    moved = migrate_flat_data(DATA_DIR, guild_registry.path(LEGACY_GUILD_ID))
+    print(f"📦 Данные перенесены на сервер {LEGACY_GUILD_ID}: {moved}")
+
+
+# Prometheus text format on http://METRICS_HOST:METRICS_PORT/metrics
+# (METRICS_PORT=0 disables the endpoint, !stats works regardless)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+STARTED_AT = int(time.time())
+STARTED_PERF = time.perf_counter()
+
+
+# Artifacts for chat activity: ACTIVITY_POINTS per message at most once per
+# ACTIVITY_COOLDOWN seconds and ACTIVITY_DAILY_CAP per day (0 = no cap);
+# ACTIVITY_POINTS=0 disables it
+ACTIVITY_POINTS = int(os.getenv("ACTIVITY_POINTS", "0"))
+ACTIVITY_COOLDOWN = float(os.getenv("ACTIVITY_COOLDOWN", "60"))
+ACTIVITY_DAILY_CAP = int(os.getenv("ACTIVITY_DAILY_CAP", "100"))
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "30"))
+activity = ActivityAccrual(ACTIVITY_POINTS, ACTIVITY_COOLDOWN,
+                           ACTIVITY_DAILY_CAP)
+
+
+# Artifacts for voice: VOICE_POINTS per VOICE_SECONDS_PER_POINT seconds in a
+# voice channel (not AFK, not muted/deafened), credited every
+# VOICE_TICK_INTERVAL seconds; VOICE_POINTS=0 disables it. After a restart
+# sessions of members still in voice continue if the bot was down for at
+# most VOICE_RESTART_GAP seconds
+VOICE_POINTS = int(os.getenv("VOICE_POINTS", "0"))
+VOICE_SECONDS_PER_POINT = float(os.getenv("VOICE_SECONDS_PER_POINT", "600"))
+VOICE_TICK_INTERVAL = float(os.getenv("VOICE_TICK_INTERVAL", "60"))
+VOICE_RESTART_GAP = float(os.getenv("VOICE_RESTART_GAP", "300"))
+voice = VoiceTracker(os.path.join(DATA_DIR, "voice_sessions.json"),
+                     VOICE_SECONDS_PER_POINT, VOICE_POINTS)
+if VOICE_POINTS > 0:
+    voice.load()
+
+
+# Ended giveaways move to compressed per-giveaway files after ARCHIVE_AFTER
+ARCHIVE_AFTER = int(os.getenv("ARCHIVE_AFTER", str(7 * 86400)))
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "3600"))
+
+
+# Scheduled and recurring giveaways (!gschedule): dates and cron
+# expressions are read in SCHEDULE_TIMEZONE
+SCHEDULE_TIMEZONE = ZoneInfo(os.getenv("SCHEDULE_TIMEZONE", "UTC"))
 
-# Save data
-def save_data():
-    try:
-        with open(DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(giveaways, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"Error saving data: {e}")
 
+# Load data
+def load_data() -> int:
+    """Открыть данные всех серверов с диска и поставить таймеры (один раз).
 
-# Load points data
-def load_points():
-    try:
-        if os.path.exists(POINTS_FILE):
-            with open(POINTS_FILE, "r") as f:
-                return json.load(f)
-        else:
-            return {"users": {}, "role_rewards": {}}
-    except Exception as e:
-        print(f"Error loading points: {e}")
-        return {"users": {}, "role_rewards": {}}
+    Guilds without data are opened lazily on first use. Returns the number
+    of open giveaways that are still running.
+    """
+    started = time.perf_counter()
+    guild_registry.load_existing()
+    loaded = time.perf_counter()
+    active_count = sum(schedule_giveaways(data) for data in guild_registry)
+    STARTUP_SECONDS.set(loaded - started, phase="load")
+    STARTUP_SECONDS.set(time.perf_counter() - loaded, phase="schedule")
+    return active_count
 
 
-# Save points data
-def save_points(points_data):
-    try:
-        with open(POINTS_FILE, "w") as f:
-            json.dump(points_data, f, indent=2)
-    except Exception as e:
-        print(f"Error saving points: {e}")
+# Save data
+def save_data():
+    """Сохранить все (для shutdown)"""
+    with PERSIST_SECONDS.time(op="save_data"):
+        flush_activity()
+        if VOICE_POINTS > 0:
+            credit_batches(voice.tick(time.time()), "voice")
+            voice.save(voice.snapshot())
+        guild_registry.close()
+
+
+def change_points(data: GuildData, actor_id, deltas: Dict[str, int],
+                  reason: str) -> Dict[str, int]:
+    """Изменить балансы с записью в журнал операций, вернуть новые балансы"""
+    old = {user_id: data.points.get(user_id) for user_id in deltas}
+    balances = data.points.add_many(deltas)
+    # Balances never go below zero, record what was actually applied
+    data.ledger.record(
+        str(actor_id) if actor_id else None,
+        {user_id: points - old[user_id]
+         for user_id, points in balances.items()}, reason)
+    return balances
 
 
 # Check and update roles based on points
-async def update_user_roles(member: discord.Member, new_points: int):
+async def update_user_roles(member: discord.Member, new_points: int) -> bool:
     """Обновить роли пользователя в зависимости от количества артефактов"""
-    points_data = load_points()
-    role_rewards = points_data.get("role_rewards", {})
+    rewards_index = guild_registry.get(member.guild.id).points.rewards_index
 
-    if not role_rewards:
-        return
+    if not rewards_index:
+        return False
 
-    # Получаем все роли, которые можно выдать
-    roles_to_add = []
-    for role_id, threshold in role_rewards.items():
-        if new_points >= threshold:
-            role = member.guild.get_role(int(role_id))
-            if role and role not in member.roles:
-                roles_to_add.append(role)
+    # Какие роли выдать и какие снять (бинарный поиск по порогам)
+    held = {role.id for role in member.roles}
+    add_ids, remove_ids = rewards_index.diff(held, new_points)
 
-    # Выдаем роли
-    if roles_to_add:
-        try:
-            await member.add_roles(
-                *roles_to_add,
-                reason="Автоматическая выдача ролей за артефакты")
+    roles_to_add = [
+        role for role in map(member.guild.get_role, add_ids) if role
+    ]
+    if not roles_to_add and not remove_ids:
+        return False
+
+    removed = [role.name for role in member.roles if role.id in remove_ids]
+    reason = "Автоматическая выдача ролей за артефакты"
+
+    try:
+        if member_cache.lazy:
+            # The member may be a snapshot up to MEMBER_CACHE_TTL old: send
+            # only the change, so roles granted meanwhile are kept
+            if roles_to_add:
+                await member.add_roles(*roles_to_add, reason=reason)
+            if remove_ids:
+                await member.remove_roles(
+                    *[discord.Object(id=role_id) for role_id in remove_ids],
+                    reason=reason)
+            member_cache.discard(member.guild.id, member.id)
+        else:
+            # Одним запросом: текущие роли + новые - лишние
+            roles = [
+                role for role in member.roles
+                if not role.is_default() and role.id not in remove_ids
+            ] + roles_to_add
+            await member.edit(roles=roles, reason=reason)
+        if roles_to_add:
             print(
                 f"✅ Выданы роли {[r.name for r in roles_to_add]} пользователю {member.display_name}"
             )
+        if removed:
+            print(
+                f"➖ Сняты роли {removed} у пользователя {member.display_name}"
+            )
+        return True
+    except Exception as e:
+        print(f"❌ Ошибка выдачи ролей: {e}")
+        return False
+
+
+def credit_batches(batches: Dict[int, Dict[str, int]],
+                   reason: str) -> List[tuple]:
+    """Записать автоматические начисления пачками по серверам.
+
+    Returns (guild_id, user_id, points) of users whose balance crossed a
+    reward threshold, only they need a role update.
+    """
+    crossed = []
+    for guild_id, deltas in batches.items():
+        data = guild_registry.get(guild_id)
+        old = {user_id: data.points.get(user_id) for user_id in deltas}
+        balances = change_points(data, None, deltas, reason)
+        rewards_index = data.points.rewards_index
+        crossed.extend((guild_id, user_id, points)
+                       for user_id, points in balances.items()
+                       if rewards_index.crossed(old[user_id], points))
+    return crossed
+
+
+async def sync_crossed_roles(crossed: List[tuple]):
+    """Обновить роли тех, кто перешел порог наград"""
+    by_guild: Dict[int, Dict[int, int]] = {}
+    for guild_id, user_id, points in crossed:
+        by_guild.setdefault(guild_id, {})[int(user_id)] = points
+    for guild_id, balances in by_guild.items():
+        guild = bot.get_guild(guild_id)
+        if not guild:
+            continue
+        members = await member_cache.resolve(guild, balances)
+        for user_id, member in members.items():
+            await role_sync_limiter.acquire()
+            await update_user_roles(member, balances[user_id])
+
+
+def flush_activity() -> List[tuple]:
+    return credit_batches(activity.drain(), "activity")
+
+
+async def activity_loop():
+    while True:
+        await asyncio.sleep(ACTIVITY_FLUSH_INTERVAL)
+        activity.prune(time.time())
+        await sync_crossed_roles(flush_activity())
+
+
+def voice_eligible(member: discord.Member,
+                   state: Optional[discord.VoiceState]) -> bool:
+    """Идет ли время в голосе: не бот, не AFK, без мута и заглушения"""
+    if member.bot or state is None or state.channel is None:
+        return False
+    if state.channel == member.guild.afk_channel:
+        return False
+    return not (state.self_mute or state.self_deaf or state.mute
+                or state.deaf)
+
+
+def reconcile_voice(guild: discord.Guild):
+    """Сверить сессии сервера с текущими голосовыми каналами"""
+    present = [
+        member.id for channel in guild.voice_channels
+        for member in channel.members if voice_eligible(member, member.voice)
+    ]
+    voice.reconcile(guild.id, present, time.time(), VOICE_RESTART_GAP)
+
+
+async def voice_loop():
+    # One tick: one ledger/points batch per guild, one sessions file write
+    # and one role pass over the users that crossed a threshold
+    while True:
+        await asyncio.sleep(VOICE_TICK_INTERVAL)
+        crossed = credit_batches(voice.tick(time.time()), "voice")
+        payload = voice.snapshot()
+        try:
+            with PERSIST_SECONDS.time(op="voice_sessions"):
+                await asyncio.to_thread(voice.save, payload)
         except Exception as e:
-            print(f"❌ Ошибка выдачи ролей: {e}")
+            print(f"Error saving voice sessions: {e}")
+        await sync_crossed_roles(crossed)
+
+
+# Bulk role sync (!checkroles, !addmany): bounded workers + token bucket,
+# resumable. Jobs share one limiter; job_id is the guild ID for !checkroles
+ROLE_SYNC_WORKERS = int(os.getenv("ROLE_SYNC_WORKERS", "4"))
+ROLE_SYNC_RATE = float(os.getenv("ROLE_SYNC_RATE", "5"))
+role_sync_limiter = TokenBucket(ROLE_SYNC_RATE, burst=ROLE_SYNC_WORKERS)
+role_sync_jobs: Dict[str, RoleSyncJob] = {}
+
+
+def role_sync_state_path(job_id: str) -> str:
+    return os.path.join(DATA_DIR, f"rolesync_{job_id}.json")
+
+
+async def plan_role_sync(guild: discord.Guild,
+                         candidates: Iterable[str] = None) -> List[str]:
+    """Сталкеры, чьи роли расходятся с артефактами (по кэшу ролей)"""
+    points_store = guild_registry.get(guild.id).points
+    rewards_index = points_store.rewards_index
+    if not rewards_index:
+        return []
+
+    if candidates is None:
+        # Users with points plus anyone holding a reward role without points
+        # (role members are only known with the full member cache)
+        candidates = set(points_store.users)
+        for role_id in rewards_index.managed:
+            role = guild.get_role(role_id)
+            if role:
+                candidates.update(str(member.id) for member in role.members)
+
+    changes = []
+    members = await member_cache.resolve(guild, candidates)
+    for user_id, member in members.items():
+        held = {role.id for role in member.roles}
+        add_ids, remove_ids = rewards_index.diff(
+            held, points_store.get(str(user_id)))
+        if add_ids or remove_ids:
+            changes.append(str(user_id))
+    return changes
+
+
+def role_sync_status(job: RoleSyncJob) -> str:
+    return (f"🔄 Синхронизация ролей: {job.done}/{job.total}"
+            f" • изменено {job.changed}")
+
+
+async def run_role_sync(guild: discord.Guild,
+                        channel_id: int,
+                        user_ids: List[str],
+                        job_id: str = None,
+                        state: dict = None):
+    """Применить роли для user_ids, показывая прогресс в канале"""
+    job_id = job_id or str(guild.id)
+    points_store = guild_registry.get(guild.id).points
+    message = None
+
+    async def apply(user_id: str) -> bool:
+        member = await member_cache.fetch(guild, user_id)
+        if not member:
+            return False
+        return await update_user_roles(member, points_store.get(user_id))
+
+    async def progress(job: RoleSyncJob):
+        await outbox.submit(
+            channel_id,
+            functools.partial(message.edit, content=role_sync_status(job)),
+            LOW,
+            key=message.id,
+            edit=True)
+
+    job = RoleSyncJob(role_sync_state_path(job_id),
+                      user_ids,
+                      apply,
+                      role_sync_limiter,
+                      workers=ROLE_SYNC_WORKERS,
+                      meta={
+                          "job_id": job_id,
+                          "guild_id": guild.id,
+                          "channel_id": channel_id
+                      },
+                      on_progress=progress)
+    if state:
+        job.restore(state)
+    role_sync_jobs[job_id] = job
+
+    channel = bot.get_partial_messageable(channel_id)
+    message_id = (state or {}).get("meta", {}).get("message_id")
+    try:
+        if message_id:
+            message = channel.get_partial_message(message_id)
+        else:
+            message = await outbox.submit(
+                channel_id,
+                functools.partial(channel.send, role_sync_status(job)),
+                NORMAL)
+    except Exception:
+        role_sync_jobs.pop(job_id, None)
+        raise
+    job.meta["message_id"] = message.id
+
+    try:
+        await job.run()
+    finally:
+        role_sync_jobs.pop(job_id, None)
+
+    try:
+        await outbox.submit(
+            channel_id,
+            functools.partial(
+                message.edit,
+                content=f"✅ Обновлены роли для {job.changed} сталкеров"
+                f" (проверено {job.done}, ошибок {job.failed})"),
+            NORMAL,
+            key=message.id,
+            edit=True)
+    except Exception as e:
+        print(f"Error reporting role sync progress: {e}")
+
+
+def resume_role_sync():
+    """Продолжить синхронизации, прерванные перезапуском"""
+    for path in glob.glob(os.path.join(DATA_DIR, "rolesync_*.json")):
+        state = RoleSyncJob.load(path)
+        if not state or not state.get("pending"):
+            continue
+        meta = state.get("meta", {})
+        job_id = meta.get("job_id", str(meta.get("guild_id")))
+        guild = bot.get_guild(meta.get("guild_id", 0))
+        if not guild or job_id in role_sync_jobs:
+            continue
+        print(f"🔄 Продолжаем синхронизацию ролей: {len(state['pending'])}")
+        asyncio.create_task(
+            run_role_sync(guild, meta["channel_id"], state["pending"], job_id,
+                          state))
 
 
 # Duration parsing
@@ -206,239 +535,841 @@ def pick_flavor() -> str:
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True  # Добавляем для работы с ролями
-bot = commands.Bot(command_prefix="!", intents=intents, help_command=None)
+
+# Low-memory mode: no member chunking and no member cache, members are
+# looked up by ID when needed (leaderboard page, role updates) and kept in
+# an LRU of MEMBER_CACHE_SIZE entries for MEMBER_CACHE_TTL seconds.
+# !checkroles then only sees users that have points
+LOW_MEMORY_MEMBERS = os.getenv("LOW_MEMORY_MEMBERS", "0") == "1"
+MEMBER_CACHE_SIZE = int(os.getenv("MEMBER_CACHE_SIZE", "10000"))
+MEMBER_CACHE_TTL = float(os.getenv("MEMBER_CACHE_TTL", "600"))
+member_cache = MemberCache(LOW_MEMORY_MEMBERS, MEMBER_CACHE_SIZE,
+                           MEMBER_CACHE_TTL)
+member_cache_flags = discord.MemberCacheFlags.from_intents(intents)
+if LOW_MEMORY_MEMBERS:
+    member_cache_flags = discord.MemberCacheFlags.none()
+    # Voice accrual still needs the members sitting in voice channels
+    member_cache_flags.voice = VOICE_POINTS > 0
+
+
+# Channel messages and edits are queued per channel: OUTBOX_RATE per second
+# with bursts of OUTBOX_BURST for new messages and the same again for edits,
+# replies and announcements first
+OUTBOX_RATE = float(os.getenv("OUTBOX_RATE", "1"))
+OUTBOX_BURST = int(os.getenv("OUTBOX_BURST", "5"))
+outbox = Outbox(OUTBOX_RATE, OUTBOX_BURST)
+
+
+def log_outbox_failure(what: str):
+    """Done-callback для запросов, результат которых никто не ждет"""
+
+    def report(future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            print(f"Error {what}: {future.exception()}")
+
+    return report
+
+
+class OutboxContext(commands.Context):
+    """Command replies go through the outbox at reply priority"""
+
+    async def send(self, *args, **kwargs):
+        return await outbox.submit(
+            self.channel.id,
+            functools.partial(commands.Context.send, self, *args, **kwargs),
+            URGENT)
+
+
+class GiveawayBot(commands.Bot):
+
+    async def get_context(self, origin, *, cls=OutboxContext):
+        return await super().get_context(origin, cls=cls)
+
+
+bot = GiveawayBot(command_prefix="!",
+                  intents=intents,
+                  help_command=None,
+                  chunk_guilds_at_startup=not LOW_MEMORY_MEMBERS,
+                  member_cache_flags=member_cache_flags)
+
+
+@bot.check
+async def guild_only(ctx) -> bool:
+    # All data is per guild, commands make no sense in DMs
+    return ctx.guild is not None
 
 
 # Giveaway View
 class GiveawayView(View):
+    """Button layout of a giveaway message.
+
+    The view is stopped right away so discord.py does not keep it in its
+    view store: clicks are routed by custom_id in on_interaction instead,
+    so no View object stays alive per giveaway.
+    """
 
     def __init__(self, giveaway_id: str):
         super().__init__(timeout=None)
-        self.giveaway_id = giveaway_id
 
-        self.join_btn = Button(label="Участвовать",
-                               style=discord.ButtonStyle.primary,
-                               custom_id=f"join_{giveaway_id}")
-        self.list_btn = Button(label="📜 Участники",
-                               style=discord.ButtonStyle.secondary,
-                               custom_id=f"list_{giveaway_id}")
-        self.luck_btn = Button(label="🎯 Моя удача",
-                               style=discord.ButtonStyle.success,
-                               custom_id=f"luck_{giveaway_id}")
-
-        self.join_btn.callback = self.join_action
-        self.list_btn.callback = self.list_action
-        self.luck_btn.callback = self.luck_action
-
-        self.add_item(self.join_btn)
-        self.add_item(self.list_btn)
-        self.add_item(self.luck_btn)
-
-    async def join_action(self, interaction: discord.Interaction):
-        if interaction.user.bot:
-            return
+        self.add_item(
+            Button(label="Участвовать",
+                   style=discord.ButtonStyle.primary,
+                   custom_id=f"join_{giveaway_id}"))
+        self.add_item(
+            Button(label="📜 Участники",
+                   style=discord.ButtonStyle.secondary,
+                   custom_id=f"list_{giveaway_id}"))
+        self.add_item(
+            Button(label="🎯 Моя удача",
+                   style=discord.ButtonStyle.success,
+                   custom_id=f"luck_{giveaway_id}"))
 
-        giveaway_id = self.giveaway_id
-        user_id = str(interaction.user.id)
+        self.stop()
 
-        if giveaway_id not in giveaways:
-            await interaction.response.send_message("❌ Розыгрыш не найден",
-                                                    ephemeral=True)
-            return
 
-        giveaway = giveaways[giveaway_id]
+# Points-weighted entries (!gweight): giveaway['weighting'] names a curve
+# from lottery.CURVES, weight = base + curve(min(points, weight_cap))
+ENTRY_BASE_WEIGHT = float(os.getenv("ENTRY_BASE_WEIGHT", "1"))
+ENTRY_WEIGHT_CAP = int(os.getenv("ENTRY_WEIGHT_CAP", "0"))
 
-        if giveaway.get('ended'):
-            await interaction.response.send_message("❌ Розыгрыш завершен",
-                                                    ephemeral=True)
-            return
+# guild_id -> giveaway_id -> running weights of open weighted giveaways
+entry_pools: Dict[int, Dict[str, WeightedEntries]] = {}
 
-        participants = giveaway.get('participants', [])
 
-        if user_id in participants:
-            participants.remove(user_id)
-            message = "✅ Вы вышли из розыгрыша"
-        else:
-            participants.append(user_id)
-            message = "✅ Вы вступили в розыгрыш"
+def giveaway_weight(giveaway: dict):
+    """Функция вес(артефакты) розыгрыша или None для обычного"""
+    curve = giveaway.get('weighting')
+    if curve not in CURVES:
+        return None
+    cap = giveaway.get('weight_cap', ENTRY_WEIGHT_CAP)
+    return lambda points: entry_weight(points, curve, cap, ENTRY_BASE_WEIGHT)
 
-        giveaway['participants'] = participants
-        save_data()
 
-        await interaction.response.send_message(message, ephemeral=True)
-        await self.update_giveaway_message(giveaway_id)
+def entry_pool(data: GuildData, giveaway_id: str,
+               giveaway: dict) -> Optional[WeightedEntries]:
+    """Веса участников: строятся один раз, дальше обновляются по событиям"""
+    weight = giveaway_weight(giveaway)
+    if weight is None:
+        return None
 
-    async def list_action(self, interaction: discord.Interaction):
-        giveaway_id = self.giveaway_id
+    pools = entry_pools.get(data.guild_id)
+    if pools is None:
+        pools = entry_pools[data.guild_id] = {}
 
-        if giveaway_id not in giveaways:
-            await interaction.response.send_message("❌ Розыгрыш не найден",
-                                                    ephemeral=True)
-            return
+        # Balance changes move the weight in every open pool of the guild
+        def update_weights(user_id: str, points: int):
+            for pool in pools.values():
+                pool.update(user_id, points)
+
+        data.points.listeners.append(update_weights)
+
+    pool = pools.get(giveaway_id)
+    if pool is None:
+        pool = pools[giveaway_id] = WeightedEntries(weight)
+        for uid in participants_of(giveaway):
+            pool.set(uid, data.points.get(str(uid)))
+    return pool
+
+
+def drop_entry_pool(data: GuildData, giveaway_id: str):
+    entry_pools.get(data.guild_id, {}).pop(giveaway_id, None)
+
+
+# Entry requirements (!greq): giveaway['requirements'] is the dict form of
+# requirements.EntryRequirements; parsed rules are cached per open giveaway
+entry_rules: Dict[int, Dict[str, EntryRequirements]] = {}
+
+REQUIREMENT_FAILURES = {
+    "points": "Нужно не меньше {min_points} артефактов",
+    "age": "Аккаунт слишком молод для Зоны",
+    "role": "Нужна одна из ролей: {roles}",
+    "forbidden": "С ролью {forbidden} участвовать нельзя",
+}
+
+
+def requirements_of(data: GuildData, giveaway_id: str,
+                    giveaway: dict) -> EntryRequirements:
+    rules = entry_rules.get(data.guild_id, {}).get(giveaway_id)
+    if rules is None:
+        rules = EntryRequirements.from_dict(giveaway.get('requirements'))
+        if not giveaway.get('ended'):
+            entry_rules.setdefault(data.guild_id, {})[giveaway_id] = rules
+    return rules
+
+
+def drop_requirements(data: GuildData, giveaway_id: str):
+    entry_rules.get(data.guild_id, {}).pop(giveaway_id, None)
+
+
+def describe_requirements(rules: EntryRequirements) -> List[str]:
+    lines = []
+    if rules.min_points:
+        lines.append(f"от {rules.min_points} артефактов")
+    if rules.roles:
+        lines.append("роль: " + " или ".join(f"<@&{r}>" for r in rules.roles))
+    if rules.forbidden_roles:
+        lines.append("без ролей: " +
+                     ", ".join(f"<@&{r}>" for r in rules.forbidden_roles))
+    if rules.account_age:
+        lines.append(f"аккаунт старше {format_time(rules.account_age)}")
+    return lines
+
+
+def requirement_failure_text(rules: EntryRequirements, failure: str) -> str:
+    return REQUIREMENT_FAILURES[failure].format(
+        min_points=rules.min_points,
+        roles=", ".join(f"<@&{r}>" for r in rules.roles),
+        forbidden=", ".join(f"<@&{r}>" for r in rules.forbidden_roles))
+
+
+async def eligible_participants(data: GuildData, giveaway_id: str,
+                                giveaway: dict) -> Optional[List[int]]:
+    """Участники, которые проходят условия на момент розыгрыша.
+
+    None when the giveaway has no requirements. Balance and account age are
+    checked for everyone from memory; roles only for those left, with one
+    batched member lookup. Raises LookupError (the guild is unavailable) or
+    TimeoutError (the lookup timed out) instead of treating entrants whose
+    roles could not be checked as ineligible.
+    """
+    rules = requirements_of(data, giveaway_id, giveaway)
+    if not rules:
+        return None
+
+    eligible = rules.filter(participants_of(giveaway), data.points.get)
+    if rules.needs_roles and eligible:
+        guild = bot.get_guild(data.guild_id)
+        if guild is None:
+            raise LookupError(f"guild {data.guild_id} is unavailable")
+        members = await member_cache.resolve(guild, eligible, strict=True)
+        eligible = [
+            uid for uid in eligible if uid in members and rules.failure(
+                uid, data.points.get(str(uid)),
+                {role.id for role in members[uid].roles}) is None
+        ]
+    return eligible
+
+
+def draw_winners(data: GuildData,
+                 giveaway: dict,
+                 count: int,
+                 eligible: Optional[List[int]] = None) -> List[int]:
+    """Победители: равные шансы или по весу от текущих артефактов"""
+    weight = giveaway_weight(giveaway)
+    if eligible is None:
+        participants = participants_of(giveaway)
+        if weight is None:
+            return participants.sample(count)
+    else:
+        participants = eligible
+        if weight is None:
+            return random.sample(participants, min(count, len(participants)))
+    return weighted_sample(
+        ((uid, weight(data.points.get(str(uid)))) for uid in participants),
+        count)
+
+
+async def join_action(interaction: discord.Interaction, giveaway_id: str):
+    if interaction.user.bot:
+        return
+
+    user_id = str(interaction.user.id)
+    data = guild_registry.get(interaction.guild_id)
+
+    if giveaway_id not in data.giveaways:
+        await interaction.response.send_message("❌ Розыгрыш не найден",
+                                                ephemeral=True)
+        return
+
+    giveaway = data.giveaways[giveaway_id]
 
-        giveaway = giveaways[giveaway_id]
-        participants = giveaway.get('participants', [])
+    if giveaway.get('ended'):
+        await interaction.response.send_message("❌ Розыгрыш завершен",
+                                                ephemeral=True)
+        return
+
+    participants = participants_of(giveaway)
+    pool = entry_pools.get(data.guild_id, {}).get(giveaway_id)
+
+    if user_id in participants:
+        data.giveaway_store.leave(giveaway_id, user_id)
+        if pool is not None:
+            pool.discard(user_id)
+        message = "✅ Вы вышли из розыгрыша"
+    else:
+        # In-memory balance and the roles sent with the interaction
+        rules = requirements_of(data, giveaway_id, giveaway)
+        if rules:
+            failure = rules.failure(
+                interaction.user.id, data.points.get(user_id),
+                {role.id for role in getattr(interaction.user, 'roles', ())})
+            if failure:
+                await interaction.response.send_message(
+                    f"❌ {requirement_failure_text(rules, failure)}",
+                    ephemeral=True)
+                return
+        data.giveaway_store.join(giveaway_id, user_id)
+        if pool is not None:
+            pool.set(user_id, data.points.get(user_id))
+        message = "✅ Вы вступили в розыгрыш"
+
+    await interaction.response.send_message(message, ephemeral=True)
+    # Edits are coalesced per giveaway, see GiveawayEmbedRefresher
+    embed_refresher.schedule(data, giveaway_id)
+
+# Participant browser (📜 button): rendered pages are cached per giveaway
+# and rebuilt only after the participant set changed
+PARTICIPANTS_PAGE_SIZE = 20
+PARTICIPANT_PAGES_CACHE = 256
+
+
+class ParticipantPages:
+    """Participant list pages of one giveaway.
+
+    Pages are sliced straight from the Participants array, no copy of the
+    IDs is kept; rendered text is valid while the Participants object and
+    its version are unchanged.
+    """
+
+    def __init__(self, participants):
+        self.participants = participants
+        self.version = participants.version
+        self.pages: Dict[int, str] = {}
+
+    def fresh(self, participants) -> bool:
+        return (participants is self.participants
+                and participants.version == self.version)
+
+    def __len__(self) -> int:
+        return len(self.participants)
+
+    def page_count(self) -> int:
+        return max(1, -(-len(self) // PARTICIPANTS_PAGE_SIZE))
+
+    def clamp(self, page: int) -> int:
+        return min(max(page, 0), self.page_count() - 1)
+
+    def render(self, page: int) -> str:
+        text = self.pages.get(page)
+        if text is None:
+            start = page * PARTICIPANTS_PAGE_SIZE
+            text = "\n".join(
+                f"{number}. <@{uid}>" for number, uid in enumerate(
+                    self.participants.page(start, PARTICIPANTS_PAGE_SIZE),
+                    start + 1))
+            self.pages[page] = text
+        return text
+
+    def position(self, uid: int) -> Optional[int]:
+        """Номер участника (с 0) или None"""
+        return self.participants.position(uid)
+
+
+participant_pages: "OrderedDict[str, ParticipantPages]" = OrderedDict()
+
+
+def pages_of(data: GuildData, giveaway_id: str,
+             giveaway: dict) -> ParticipantPages:
+    key = giveaway_key(data.guild_id, giveaway_id)
+    participants = participants_of(giveaway)
+    pages = participant_pages.get(key)
+    if pages is None or not pages.fresh(participants):
+        pages = participant_pages[key] = ParticipantPages(participants)
+    participant_pages.move_to_end(key)
+    if len(participant_pages) > PARTICIPANT_PAGES_CACHE:
+        participant_pages.popitem(last=False)
+    return pages
+
+
+def find_participant(guild: discord.Guild, pages: ParticipantPages,
+                     query: str) -> Optional[int]:
+    """Найти участника по ID, упоминанию или части имени"""
+    query = query.strip()
+    digits = query.strip("<@!>")
+    if digits.isdigit():
+        return pages.position(int(digits))
+
+    query = query.lower()
+    for position, uid in enumerate(pages.participants):
+        # Cached members only: a search must not query every participant
+        member = member_cache.get(guild, uid) if guild else None
+        if member and query in member.display_name.lower():
+            return position
+    return None
+
+
+class ParticipantJumpModal(discord.ui.Modal, title="Перейти к странице"):
+    page = discord.ui.TextInput(label="Страница", max_length=6)
+
+    def __init__(self, browser: "ParticipantBrowser"):
+        super().__init__()
+        self.browser = browser
+
+    async def on_submit(self, interaction: discord.Interaction):
+        try:
+            page = int(self.page.value) - 1
+        except ValueError:
+            page = self.browser.page
+        await self.browser.show(interaction, page)
 
-        if not participants:
-            await interaction.response.send_message(
-                "👥 Пока никто не участвует", ephemeral=True)
+
+class ParticipantSearchModal(discord.ui.Modal, title="Найти сталкера"):
+    query = discord.ui.TextInput(label="ID, упоминание или имя",
+                                 max_length=100)
+
+    def __init__(self, browser: "ParticipantBrowser"):
+        super().__init__()
+        self.browser = browser
+
+    async def on_submit(self, interaction: discord.Interaction):
+        await self.browser.search(interaction, self.query.value)
+
+
+class ParticipantBrowser(View):
+    """Ephemeral paginated participant list"""
+
+    def __init__(self, data: GuildData, giveaway_id: str):
+        super().__init__(timeout=300)
+        self.data = data
+        self.giveaway_id = giveaway_id
+        self.page = 0
+
+        buttons = [("◀", self.prev_action), ("▶", self.next_action),
+                   ("🔢", self.jump_action), ("🔎", self.search_action)]
+        for label, callback in buttons:
+            button = Button(label=label, style=discord.ButtonStyle.secondary)
+            button.callback = callback
+            self.add_item(button)
+
+    def content(self, note: str = "") -> Optional[str]:
+        giveaway = self.data.giveaways.get(self.giveaway_id)
+        if giveaway is None:
+            return None
+        pages = pages_of(self.data, self.giveaway_id, giveaway)
+        self.page = pages.clamp(self.page)
+        if not pages:
+            return "👥 Пока никто не участвует"
+        text = (f"👥 Участников: {len(pages)} • страница "
+                f"{self.page + 1}/{pages.page_count()}\n"
+                f"{pages.render(self.page)}")
+        return f"{note}\n{text}" if note else text
+
+    async def show(self, interaction: discord.Interaction, page: int,
+                   note: str = ""):
+        self.page = page
+        with INTERACTION_SECONDS.time(action="participants"):
+            content = self.content(note)
+            if content is None:
+                self.stop()
+                await interaction.response.edit_message(
+                    content="❌ Розыгрыш не найден", view=None)
+                return
+            await interaction.response.edit_message(content=content,
+                                                    view=self)
+
+    async def search(self, interaction: discord.Interaction, query: str):
+        giveaway = self.data.giveaways.get(self.giveaway_id)
+        position = None
+        if giveaway is not None:
+            pages = pages_of(self.data, self.giveaway_id, giveaway)
+            position = find_participant(interaction.guild, pages, query)
+        if position is None:
+            await self.show(interaction, self.page, "🔎 Не найден")
             return
+        await self.show(interaction, position // PARTICIPANTS_PAGE_SIZE,
+                        f"🔎 Найден: №{position + 1}")
+
+    async def prev_action(self, interaction: discord.Interaction):
+        await self.show(interaction, self.page - 1)
+
+    async def next_action(self, interaction: discord.Interaction):
+        await self.show(interaction, self.page + 1)
+
+    async def jump_action(self, interaction: discord.Interaction):
+        await interaction.response.send_modal(ParticipantJumpModal(self))
 
-        participant_list = "\n".join(
-            [f"<@{uid}>" for uid in participants[:20]])
-        if len(participants) > 20:
-            participant_list += f"\n... и еще {len(participants) - 20} участников"
+    async def search_action(self, interaction: discord.Interaction):
+        await interaction.response.send_modal(ParticipantSearchModal(self))
+
+
+async def list_action(interaction: discord.Interaction, giveaway_id: str):
+    data = guild_registry.get(interaction.guild_id)
+    giveaway = data.giveaways.get(giveaway_id)
+    if giveaway is None:
+        await interaction.response.send_message("❌ Розыгрыш не найден",
+                                                ephemeral=True)
+        return
 
+    if not participants_of(giveaway):
         await interaction.response.send_message(
-            f"👥 Участников: {len(participants)}\n{participant_list}",
-            ephemeral=True)
+            "👥 Пока никто не участвует", ephemeral=True)
+        return
 
-    async def luck_action(self, interaction: discord.Interaction):
-        giveaway_id = self.giveaway_id
+    browser = ParticipantBrowser(data, giveaway_id)
+    await interaction.response.send_message(browser.content(),
+                                            view=browser,
+                                            ephemeral=True)
 
-        if giveaway_id not in giveaways:
-            await interaction.response.send_message("❌ Розыгрыш не найден",
-                                                    ephemeral=True)
-            return
+async def luck_action(interaction: discord.Interaction, giveaway_id: str):
+    data = guild_registry.get(interaction.guild_id)
+    giveaways = data.giveaways
+    if giveaway_id not in giveaways:
+        await interaction.response.send_message("❌ Розыгрыш не найден",
+                                                ephemeral=True)
+        return
 
-        giveaway = giveaways[giveaway_id]
+    giveaway = giveaways[giveaway_id]
 
-        if giveaway.get('ended'):
-            await interaction.response.send_message("❌ Розыгрыш завершен",
-                                                    ephemeral=True)
-            return
+    if giveaway.get('ended'):
+        await interaction.response.send_message("❌ Розыгрыш завершен",
+                                                ephemeral=True)
+        return
 
-        user_id = str(interaction.user.id)
-        participants = giveaway.get('participants', [])
-        winners_count = giveaway.get('winners', 1)
-        end_time = giveaway.get('end_time', 0)
+    user_id = str(interaction.user.id)
+    participants = participants_of(giveaway)
+    winners_count = giveaway.get('winners', 1)
+    end_time = giveaway.get('end_time', 0)
 
-        is_participating = user_id in participants
-        total_participants = len(participants)
+    is_participating = user_id in participants
+    total_participants = len(participants)
 
-        if total_participants == 0:
-            chance = 0
-            chance_text = "0%"
-        else:
-            chance = (winners_count / total_participants) * 100
-            chance_text = f"{chance:.1f}%"
+    # Weighted giveaways keep a running total, no pass over participants
+    pool = entry_pool(data, giveaway_id, giveaway)
+    points = data.points.get(user_id)
 
-        remaining = max(0, end_time - int(time.time()))
-        time_left = format_time(remaining)
+    if total_participants == 0:
+        chance = 0
+        chance_text = "0%"
+    elif pool is not None:
+        chance = pool.chance(user_id, winners_count, points) * 100
+        chance_text = f"{chance:.1f}%"
+    else:
+        chance = (winners_count / total_participants) * 100
+        chance_text = f"{chance:.1f}%"
+
+    remaining = max(0, end_time - int(time.time()))
+    time_left = format_time(remaining)
+
+    response = (
+        f"🎯 **Ваш шанс:** {chance_text}\n"
+        f"✅ **Участвуете:** {'Да' if is_participating else 'Нет'}\n"
+        f"👥 **Участников:** {total_participants}\n"
+        f"🏆 **Победителей:** {winners_count}\n"
+        f"⏰ **Осталось:** {time_left}")
+    if pool is not None:
+        response += (f"\n⚖️ **Вес:** {pool.weight(points):.1f}"
+                     f" ({giveaway['weighting']})")
+
+    await interaction.response.send_message(response, ephemeral=True)
+
+
+# Giveaway buttons: custom_id "<action>_<giveaway_id>" -> handler
+GIVEAWAY_BUTTON_RE = re.compile(r"^(join|list|luck)_([\w-]+)$")
+GIVEAWAY_BUTTON_HANDLERS = {
+    "join": join_action,
+    "list": list_action,
+    "luck": luck_action,
+}
+
+
+async def dispatch_giveaway_button(interaction: discord.Interaction) -> bool:
+    """Обработать нажатие кнопки розыгрыша, если это она"""
+    if (interaction.type != discord.InteractionType.component
+            or interaction.guild_id is None):
+        return False
+
+    match = GIVEAWAY_BUTTON_RE.match(
+        (interaction.data or {}).get("custom_id", ""))
+    if not match:
+        return False
+
+    action, giveaway_id = match.groups()
+    try:
+        with INTERACTION_SECONDS.time(action=action):
+            await GIVEAWAY_BUTTON_HANDLERS[action](interaction, giveaway_id)
+    except Exception as e:
+        INTERACTION_ERRORS.inc(action=action)
+        print(f"Error handling {action} for giveaway {giveaway_id}: {e}")
+    return True
 
-        response = (
-            f"🎯 **Ваш шанс:** {chance_text}\n"
-            f"✅ **Участвуете:** {'Да' if is_participating else 'Нет'}\n"
-            f"👥 **Участников:** {total_participants}\n"
-            f"🏆 **Победителей:** {winners_count}\n"
-            f"⏰ **Осталось:** {time_left}")
 
-        await interaction.response.send_message(response, ephemeral=True)
+def render_giveaway_embed(giveaway_id: str, giveaway: dict) -> discord.Embed:
+    embed = discord.Embed(title="🎉 РОЗЫГРЫШ В ЗОНЕ",
+                          description=giveaway.get('flavor', ''),
+                          color=0x2b5329)
 
-    async def update_giveaway_message(self, giveaway_id: str):
-        if giveaway_id not in giveaways:
+    embed.add_field(name="🏆 Трофей", value=giveaway['prize'], inline=False)
+    # Relative timestamp is rendered by the client, so the embed does not
+    # go stale between edits
+    embed.add_field(name="⏰ Осталось в Зоне",
+                    value=f"<t:{int(giveaway['end_time'])}:R>",
+                    inline=True)
+    embed.add_field(name="👥 Сталкеров",
+                    value=str(len(participants_of(giveaway))),
+                    inline=True)
+    embed.add_field(name="🏆 Счастливчиков",
+                    value=str(giveaway['winners']),
+                    inline=True)
+    if giveaway.get('weighting') in CURVES:
+        embed.add_field(name="⚖️ Шансы",
+                        value=f"по артефактам ({giveaway['weighting']})",
+                        inline=True)
+    if giveaway.get('requirements'):
+        embed.add_field(name="📋 Условия",
+                        value="\n".join(
+                            describe_requirements(
+                                EntryRequirements.from_dict(
+                                    giveaway['requirements']))),
+                        inline=False)
+    embed.set_footer(
+        text=
+        f"ID: {giveaway_id} • Нашел: {giveaway.get('host_name', 'Неизвестный сталкер')}"
+    )
+    return embed
+
+
+class GiveawayEmbedRefresher:
+    """Coalesces giveaway embed edits.
+
+    schedule() only marks a giveaway dirty; one task per giveaway performs
+    at most one edit per interval with the latest state, edits through a
+    partial message (no fetch_message round trip) and skips the request
+    when the rendered embed did not change since the last edit.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.pending: Dict[str, asyncio.Task] = {}
+        self.last_edit: Dict[str, float] = {}
+        self.last_embed: Dict[str, dict] = {}
+
+    def schedule(self, data: GuildData, giveaway_id: str):
+        key = giveaway_key(data.guild_id, giveaway_id)
+        task = self.pending.get(key)
+        if task is not None and not task.done():
+            return
+        self.pending[key] = asyncio.create_task(
+            self._refresh(key, data, giveaway_id))
+
+    def cancel(self, data: GuildData, giveaway_id: str):
+        """Отменить обновление (розыгрыш завершен или удален)"""
+        key = giveaway_key(data.guild_id, giveaway_id)
+        task = self.pending.pop(key, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        self.last_edit.pop(key, None)
+        self.last_embed.pop(key, None)
+
+    async def _refresh(self, key: str, data: GuildData, giveaway_id: str):
+        last_edit = self.last_edit.get(key)
+        if last_edit is not None:
+            delay = last_edit + self.interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        self.pending.pop(key, None)
+
+        giveaway = data.giveaways.get(giveaway_id)
+        if not giveaway or giveaway.get('ended'):
             return
 
-        giveaway = giveaways[giveaway_id]
         channel_id = giveaway.get('channel_id')
         message_id = giveaway.get('message_id')
-
         if not channel_id or not message_id:
             return
 
+        embed = render_giveaway_embed(giveaway_id, giveaway)
+        rendered = embed.to_dict()
+        if self.last_embed.get(key) == rendered:
+            return
+
+        self.last_edit[key] = time.monotonic()
         try:
-            channel = bot.get_channel(channel_id)
-            if not channel:
-                return
+            message = bot.get_partial_messageable(
+                channel_id).get_partial_message(message_id)
+            # Cosmetic: yields to replies and announcements in the channel
+            # and is dropped if a newer edit of the message is queued
+            if await outbox.submit(channel_id,
+                                   functools.partial(message.edit,
+                                                     embed=embed),
+                                   LOW,
+                                   key=message_id,
+                                   edit=True) is not None:
+                self.last_embed[key] = rendered
+        except Exception as e:
+            print(f"Error updating message: {e}")
 
-            message = await channel.fetch_message(message_id)
-            remaining = max(0, giveaway['end_time'] - int(time.time()))
 
-            embed = discord.Embed(title="🎉 РОЗЫГРЫШ В ЗОНЕ",
-                                  description=giveaway.get('flavor', ''),
-                                  color=0x2b5329)
+EMBED_REFRESH_INTERVAL = float(os.getenv("EMBED_REFRESH_INTERVAL", "5"))
+embed_refresher = GiveawayEmbedRefresher(EMBED_REFRESH_INTERVAL)
 
-            embed.add_field(name="🏆 Трофей",
-                            value=giveaway['prize'],
-                            inline=False)
-            embed.add_field(name="⏰ Осталось в Зоне",
-                            value=format_time(remaining),
-                            inline=True)
-            embed.add_field(name="👥 Сталкеров",
-                            value=str(len(giveaway.get('participants', []))),
-                            inline=True)
-            embed.add_field(name="🏆 Счастливчиков",
-                            value=str(giveaway['winners']),
-                            inline=True)
-            embed.set_footer(
-                text=
-                f"ID: {giveaway_id} • Нашел: {giveaway.get('host_name', 'Неизвестный сталкер')}"
-            )
 
-            await message.edit(embed=embed, view=GiveawayView(giveaway_id))
+# Giveaway management
+def giveaway_key(guild_id: int, giveaway_id: str) -> str:
+    """Ключ розыгрыша в общих таймерах (ID уникальны только на сервере)"""
+    return f"{guild_id}:{giveaway_id}"
 
-        except Exception as e:
-            print(f"Error updating message: {e}")
 
+async def end_giveaway(data: GuildData, giveaway_id: str):
+    if giveaway_id not in data.giveaways:
+        return
 
-# Giveaway management
-async def giveaway_timer(giveaway_id: str):
-    while True:
-        if giveaway_id not in giveaways:
-            break
+    giveaway = data.giveaways[giveaway_id]
 
-        giveaway = giveaways[giveaway_id]
+    if giveaway.get('ended'):
+        return
+
+    winners_count = giveaway['winners']
 
-        if giveaway.get('ended'):
-            break
+    # Re-check entry requirements for everyone at once
+    try:
+        eligible = await eligible_participants(data, giveaway_id, giveaway)
+    except (LookupError, asyncio.TimeoutError) as e:
+        # Roles unknown right now: end a bit later rather than drop entrants
+        print(f"Giveaway {giveaway_id}: member lookup failed ({e!r}),"
+              f" retrying in {GIVEAWAY_RETRY_DELAY:g}s")
+        giveaway_scheduler.schedule(giveaway_key(data.guild_id, giveaway_id),
+                                    time.time() + GIVEAWAY_RETRY_DELAY)
+        return
+    if giveaway.get('ended') or giveaway_id not in data.giveaways:
+        # Ended or deleted while members were being looked up
+        return
 
-        remaining = giveaway['end_time'] - time.time()
+    # Select winners
+    winners = draw_winners(data, giveaway, winners_count, eligible)
+
+    data.giveaway_store.update(giveaway_id,
+                               ended=True,
+                               ended_at=int(time.time()),
+                               winner_ids=[str(uid) for uid in winners])
+    giveaway_scheduler.cancel(giveaway_key(data.guild_id, giveaway_id))
+    embed_refresher.cancel(data, giveaway_id)
+    drop_entry_pool(data, giveaway_id)
+    drop_requirements(data, giveaway_id)
+
+    # Handed to the outbox without waiting, so a busy channel does not hold
+    # a scheduler slot: the announcement goes out first, the ended embed
+    # replaces any pending refresh of the giveaway message
+    update_ended_message(giveaway_id, giveaway, winners)
+    announce_winners(giveaway, winners)
 
-        if remaining <= 0:
-            await end_giveaway(giveaway_id)
-            break
+    print(f"Giveaway {giveaway_id} ended with {len(winners)} winners")
 
-        await asyncio.sleep(min(30, remaining))
 
-    print(f"Timer ended for giveaway {giveaway_id}")
+def schedule_key(guild_id: int, schedule_id: str) -> str:
+    """Ключ расписания в общих таймерах"""
+    return f"schedule:{guild_id}:{schedule_id}"
 
 
-async def end_giveaway(giveaway_id: str):
-    if giveaway_id not in giveaways:
+async def run_scheduled(key: str):
+    if key.startswith("schedule:"):
+        _, guild_id, schedule_id = key.split(":", 2)
+        await start_scheduled_giveaway(guild_registry.get(guild_id),
+                                       schedule_id)
         return
+    guild_id, giveaway_id = key.split(":", 1)
+    await end_giveaway(guild_registry.get(guild_id), giveaway_id)
 
-    giveaway = giveaways[giveaway_id]
 
-    if giveaway.get('ended'):
-        return
+# One timer for the giveaways of all guilds: ends keyed on end_time and
+# schedule starts on next_start. At most GIVEAWAY_END_CONCURRENCY of them
+# run at once, so what became overdue while the bot was offline is caught
+# up gradually
+GIVEAWAY_END_CONCURRENCY = int(os.getenv("GIVEAWAY_END_CONCURRENCY", "4"))
+giveaway_scheduler = DeadlineScheduler(run_scheduled, GIVEAWAY_END_CONCURRENCY)
 
-    giveaway['ended'] = True
-    participants = giveaway.get('participants', [])
-    winners_count = giveaway['winners']
+# Seconds to postpone an end whose entry requirements could not be checked
+# (guild unavailable, member lookup timed out)
+GIVEAWAY_RETRY_DELAY = float(os.getenv("GIVEAWAY_RETRY_DELAY", "60"))
 
-    # Select winners
-    winners = []
-    if participants:
-        if len(participants) <= winners_count:
-            winners = participants
-        else:
-            winners = random.sample(participants, winners_count)
 
-    # Update message
-    await update_ended_message(giveaway_id, winners)
+def schedule_giveaways(data: GuildData) -> int:
+    """Поставить таймеры открытых розыгрышей и расписаний сервера"""
+    active_count = 0
+    current_time = time.time()
+    for giveaway_id, giveaway in data.giveaways.items():
+        if not giveaway.get('ended'):
+            # Overdue giveaways fire right away
+            giveaway_scheduler.schedule(
+                giveaway_key(data.guild_id, giveaway_id),
+                giveaway['end_time'])
+            if giveaway['end_time'] > current_time:
+                active_count += 1
+    # A start missed while offline runs once, then the schedule goes on
+    for schedule_id, schedule in data.schedules.schedules.items():
+        giveaway_scheduler.schedule(schedule_key(data.guild_id, schedule_id),
+                                    schedule['next_start'])
+    return active_count
 
-    # Announce winners
-    await announce_winners(giveaway_id, winners)
 
-    save_data()
-    print(f"Giveaway {giveaway_id} ended with {len(winners)} winners")
+async def start_scheduled_giveaway(data: GuildData, schedule_id: str):
+    schedule = data.schedules.schedules.get(schedule_id)
+    if schedule is None:
+        return
 
+    giveaway_id = None
+    try:
+        giveaway_id = await start_giveaway(
+            data, bot.get_partial_messageable(schedule['channel_id']),
+            schedule['creator_id'], schedule['host_name'],
+            schedule['duration'], schedule['winners'], schedule['prize'])
+    except Exception as e:
+        print(f"Error starting scheduled giveaway {schedule_id}: {e}")
 
-async def update_ended_message(giveaway_id: str, winners: List[str]):
-    if giveaway_id not in giveaways:
+    upcoming = next_start(schedule, time.time(), SCHEDULE_TIMEZONE)
+    if upcoming is None:
+        data.schedules.delete(schedule_id)
         return
+    data.schedules.update(schedule_id,
+                          next_start=upcoming,
+                          last_giveaway=giveaway_id,
+                          runs=schedule.get('runs', 0) + 1)
+    giveaway_scheduler.schedule(schedule_key(data.guild_id, schedule_id),
+                                upcoming)
+
+
+async def load_giveaway(data: GuildData, giveaway_id: str):
+    """Розыгрыш из рабочего набора или (лениво) из архива"""
+    if giveaway_id in data.giveaways:
+        return data.giveaways[giveaway_id]
+    return await asyncio.to_thread(data.archive.get, giveaway_id)
+
+
+async def archive_ended_giveaways(data: GuildData):
+    """Перенести давно завершенные розыгрыши сервера в архив"""
+    giveaways = data.giveaways
+    cutoff = time.time() - ARCHIVE_AFTER
+    expired = [
+        giveaway_id for giveaway_id, giveaway in giveaways.items()
+        if giveaway.get('ended')
+        and giveaway.get('ended_at', giveaway.get('end_time', 0)) <= cutoff
+    ]
+
+    for giveaway_id in expired:
+        payload = dump_compact(giveaways[giveaway_id])
+        try:
+            await asyncio.to_thread(data.archive.put, giveaway_id, payload)
+        except Exception as e:
+            print(f"Error archiving giveaway {giveaway_id}: {e}")
+            continue
+        # The archive file is durable, now drop it from the hot set
+        if giveaway_id in giveaways:
+            data.giveaway_store.delete(giveaway_id)
 
-    giveaway = giveaways[giveaway_id]
+    if expired:
+        await data.giveaway_store.compact_async()
+        print(f"📦 В архив перенесено хабаров: {len(expired)}"
+              f" (сервер {data.guild_id})")
+
+
+async def archive_loop():
+    while True:
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+        for data in guild_registry:
+            await archive_ended_giveaways(data)
+
+
+def update_ended_message(giveaway_id: str, giveaway: dict,
+                         winners: List[int]):
     channel_id = giveaway.get('channel_id')
     message_id = giveaway.get('message_id')
 
@@ -446,11 +1377,8 @@ async def update_ended_message(giveaway_id: str, winners: List[str]):
         return
 
     try:
-        channel = bot.get_channel(channel_id)
-        if not channel:
-            return
-
-        message = await channel.fetch_message(message_id)
+        message = bot.get_partial_messageable(
+            channel_id).get_partial_message(message_id)
 
         embed = discord.Embed(title="🎉 РОЗЫГРЫШ В ЗОНЕ ЗАВЕРШЕН",
                               description=giveaway.get('flavor', ''),
@@ -469,30 +1397,30 @@ async def update_ended_message(giveaway_id: str, winners: List[str]):
                             inline=False)
 
         embed.add_field(name="👥 Сталкеров",
-                        value=str(len(giveaway.get('participants', []))),
+                        value=str(len(participants_of(giveaway))),
                         inline=True)
         embed.set_footer(text=f"ID: {giveaway_id} • Зона выбрала")
 
-        await message.edit(embed=embed, view=None)
+        outbox.submit(channel_id,
+                      functools.partial(message.edit, embed=embed, view=None),
+                      NORMAL,
+                      key=message_id,
+                      edit=True).add_done_callback(
+                          log_outbox_failure("updating ended message"))
 
     except Exception as e:
         print(f"Error updating ended message: {e}")
 
 
-async def announce_winners(giveaway_id: str, winners: List[str]):
-    if giveaway_id not in giveaways:
-        return
-
-    giveaway = giveaways[giveaway_id]
+def announce_winners(giveaway: dict, winners: List[int]):
     channel_id = giveaway.get('channel_id')
 
     if not channel_id or not winners:
         return
 
     try:
-        channel = bot.get_channel(channel_id)
-        if not channel:
-            return
+        # Works before READY too, when the channel cache is still empty
+        channel = bot.get_partial_messageable(channel_id)
 
         winner_mentions = ", ".join([f"<@{uid}>" for uid in winners])
         phrase = random.choice(WINNER_PHRASES).format(mention=winner_mentions)
@@ -501,7 +1429,10 @@ async def announce_winners(giveaway_id: str, winners: List[str]):
             description=f"🎉 {phrase}\n**Трофей:** {giveaway['prize']}",
             color=0x00ff00)
 
-        await channel.send(embed=embed)
+        outbox.submit(channel_id,
+                      functools.partial(channel.send, embed=embed),
+                      URGENT).add_done_callback(
+                          log_outbox_failure("announcing winners"))
 
     except Exception as e:
         print(f"Error announcing winners: {e}")
@@ -520,15 +1451,12 @@ async def add(ctx, member: discord.Member, amount: int):
         return
 
     user_id = str(member.id)
-    points_data = load_points()
-
-    points_data.setdefault("users", {})
-    points_data["users"][user_id] = points_data["users"].get(user_id,
-                                                             0) + amount
+    new_points = change_points(guild_registry.get(ctx.guild.id),
+                               ctx.author.id, {user_id: amount},
+                               "add")[user_id]
 
-    # Сохраняем и обновляем роли
-    save_points(points_data)
-    await update_user_roles(member, points_data["users"][user_id])
+    # Обновляем роли (сохранение произойдет в фоне)
+    await update_user_roles(member, new_points)
 
     await ctx.send(f"✅ Добавлено {amount} артефактов сталкеру {member.mention}"
                    )
@@ -546,20 +1474,111 @@ async def remove(ctx, member: discord.Member, amount: int):
         return
 
     user_id = str(member.id)
-    points_data = load_points()
-
-    points_data.setdefault("users", {})
-    current = points_data["users"].get(user_id, 0)
-    new_points = max(0, current - amount)
-    points_data["users"][user_id] = new_points
+    new_points = change_points(guild_registry.get(ctx.guild.id),
+                               ctx.author.id, {user_id: -amount},
+                               "remove")[user_id]
 
-    # Сохраняем и обновляем роли
-    save_points(points_data)
+    # Обновляем роли (сохранение произойдет в фоне)
     await update_user_roles(member, new_points)
 
     await ctx.send(f"✅ Изъято {amount} артефактов у сталкера {member.mention}")
 
 
+BULK_FILE_LIMIT = 1024 * 1024
+
+
+def parse_points_file(content: bytes, filename: str):
+    """Разобрать CSV (user_id,amount) или JSONL в {user_id: сумма} и ошибки"""
+    deltas: Dict[str, int] = {}
+    errors: List[str] = []
+    lines = content.decode("utf-8-sig").splitlines()
+
+    if filename.lower().endswith((".jsonl", ".json")):
+        rows = []
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                rows.append((number, record["user_id"], record["amount"]))
+            except (ValueError, KeyError, TypeError):
+                errors.append(f"строка {number}: {line[:40]}")
+    else:
+        rows = []
+        for number, row in enumerate(csv.reader(lines), 1):
+            if len(row) >= 2:
+                rows.append((number, *row[:2]))
+            elif row and row[0].strip():
+                errors.append(f"строка {number}: {row[0][:40]}")
+
+    for number, user_id, amount in rows:
+        try:
+            user_id = str(int(str(user_id).strip().strip("<@!>")))
+            amount = int(str(amount).strip())
+        except ValueError:
+            # Header line or garbage
+            if number > 1:
+                errors.append(f"строка {number}: {user_id},{amount}")
+            continue
+        if amount:
+            deltas[user_id] = deltas.get(user_id, 0) + amount
+
+    return deltas, errors
+
+
+@bot.command()
+async def addmany(ctx, amount: int = 0,
+                  members: commands.Greedy[discord.Member] = None):
+    """Выдать артефакты пачкой: !addmany количество @user1 @user2 ... или файл"""
+    if not ctx.author.guild_permissions.manage_messages:
+        await ctx.send("❌ Недостаточно прав, сталкер")
+        return
+
+    deltas: Dict[str, int] = {}
+    errors: List[str] = []
+
+    if ctx.message.attachments:
+        attachment = ctx.message.attachments[0]
+        if attachment.size > BULK_FILE_LIMIT:
+            await ctx.send("❌ Файл слишком большой")
+            return
+        deltas, errors = parse_points_file(await attachment.read(),
+                                           attachment.filename)
+    elif members:
+        if amount <= 0:
+            await ctx.send("❌ Количество должно быть положительным")
+            return
+        deltas = {str(member.id): amount for member in members}
+
+    if not deltas:
+        await ctx.send(
+            "❌ Укажите `!addmany количество @user ...` или приложите CSV/JSONL"
+        )
+        return
+
+    # Одна пачка изменений и одна запись на диск
+    data = guild_registry.get(ctx.guild.id)
+    change_points(data, ctx.author.id, deltas, "addmany")
+    await data.points.flush_async()
+
+    given = sum(delta for delta in deltas.values() if delta > 0)
+    taken = -sum(delta for delta in deltas.values() if delta < 0)
+    report = f"✅ Обновлено сталкеров: {len(deltas)} • выдано {given}"
+    if taken:
+        report += f" • изъято {taken}"
+    if errors:
+        report += f"\n⚠️ Пропущено строк: {len(errors)}\n" + "\n".join(
+            errors[:5])
+    await ctx.send(report)
+
+    # Роли только тем, у кого они реально меняются, одной пачкой
+    user_ids = await plan_role_sync(ctx.guild, deltas)
+    if user_ids:
+        asyncio.create_task(
+            run_role_sync(ctx.guild, ctx.channel.id, user_ids,
+                          f"{ctx.guild.id}_bulk_{ctx.message.id}"))
+
+
 @bot.command()
 async def setreward(ctx, role: discord.Role, threshold: int):
     """Установить награду за роль"""
@@ -571,11 +1590,7 @@ async def setreward(ctx, role: discord.Role, threshold: int):
         await ctx.send("❌ Порог должен быть положительным")
         return
 
-    points_data = load_points()
-    points_data.setdefault("role_rewards", {})
-    points_data["role_rewards"][str(role.id)] = threshold
-
-    save_points(points_data)
+    guild_registry.get(ctx.guild.id).points.set_reward(str(role.id), threshold)
 
     await ctx.send(
         f"✅ Роль {role.mention} будет выдаваться при {threshold} артефактах")
@@ -584,17 +1599,17 @@ async def setreward(ctx, role: discord.Role, threshold: int):
 @bot.command()
 async def rewards(ctx):
     """Показать список наград"""
-    points_data = load_points()
-    rewards_data = points_data.get("role_rewards", {})
+    rewards_index = guild_registry.get(ctx.guild.id).points.rewards_index
 
-    if not rewards_data:
+    if not rewards_index:
         await ctx.send("❌ Награды не настроены")
         return
 
     embed = discord.Embed(title="🎯 Награды в Зоне", color=0x2b5329)
 
-    for role_id, threshold in sorted(rewards_data.items(), key=lambda x: x[1]):
-        role = ctx.guild.get_role(int(role_id))
+    # Индекс уже отсортирован по порогу
+    for role_id, threshold in rewards_index:
+        role = ctx.guild.get_role(role_id)
         role_name = role.name if role else f"Роль {role_id}"
         embed.add_field(name=role_name,
                         value=f"{threshold} артефактов",
@@ -603,89 +1618,185 @@ async def rewards(ctx):
     await ctx.send(embed=embed)
 
 
-@bot.command()
-async def top(ctx):
-    """Показать топ пользователей по очкам"""
-    points_data = load_points()
-    users_data = points_data.get("users", {})
+LEADERBOARD_PAGE_SIZE = 10
+
+
+def leaderboard_source(guild_id: int, window: str = None):
+    """Баллы за все время или скользящее окно журнала (top() + leaderboard)"""
+    data = guild_registry.get(guild_id)
+    if window:
+        return data.ledger.window(window)
+    return data.points
+
+
+def leaderboard_pages(source) -> int:
+    return max(1, -(-len(source.leaderboard) // LEADERBOARD_PAGE_SIZE))
+
+
+def leaderboard_page(source, page: int) -> int:
+    """Ограничить номер страницы (с 0) существующими страницами"""
+    return min(max(page, 0), leaderboard_pages(source) - 1)
 
-    if not users_data:
-        await ctx.send("❌ Нет данных об артефактах")
-        return
 
-    # Сортируем по убыванию очков
-    sorted_users = sorted(users_data.items(), key=lambda x: x[1],
-                          reverse=True)[:10]
+async def render_leaderboard(guild: discord.Guild, page: int,
+                             window: str = None) -> discord.Embed:
+    source = leaderboard_source(guild.id, window)
+    pages = leaderboard_pages(source)
+    offset = page * LEADERBOARD_PAGE_SIZE
 
-    embed = discord.Embed(title="🏆 Топ сталкеров", color=0xffd700)
+    title = "🏆 Топ сталкеров"
+    if window:
+        title += " " + LEDGER_WINDOW_TITLES.get(window, f"за {window}")
+    embed = discord.Embed(title=title, color=0xffd700)
 
-    for i, (user_id, points) in enumerate(sorted_users, 1):
-        member = ctx.guild.get_member(int(user_id))
+    rows = source.top(LEADERBOARD_PAGE_SIZE, offset)
+    # Only the members shown on this page
+    members = await member_cache.resolve(guild, (uid for uid, _ in rows))
+    for i, (user_id, points) in enumerate(rows, offset + 1):
+        member = members.get(int(user_id))
         name = member.display_name if member else f"Сталкер {user_id}"
         embed.add_field(name=f"{i}. {name}",
                         value=f"{points} артефактов",
                         inline=False)
 
-    await ctx.send(embed=embed)
+    embed.set_footer(text=f"Страница {page + 1}/{pages}")
+    return embed
+
+
+# Leaderboard pagination
+class LeaderboardView(View):
+
+    def __init__(self, guild: discord.Guild, page: int = 0,
+                 window: str = None):
+        super().__init__(timeout=300)
+        self.window = window
+        self.page = leaderboard_page(leaderboard_source(guild.id, window),
+                                     page)
+
+        self.prev_btn = Button(label="◀", style=discord.ButtonStyle.secondary)
+        self.next_btn = Button(label="▶", style=discord.ButtonStyle.secondary)
+
+        self.prev_btn.callback = self.prev_action
+        self.next_btn.callback = self.next_action
+
+        self.add_item(self.prev_btn)
+        self.add_item(self.next_btn)
+
+    async def show(self, interaction: discord.Interaction, page: int):
+        source = leaderboard_source(interaction.guild.id, self.window)
+        self.page = leaderboard_page(source, page)
+        with INTERACTION_SECONDS.time(action="leaderboard"):
+            await interaction.response.edit_message(
+                embed=await render_leaderboard(interaction.guild, self.page,
+                                               self.window),
+                view=self)
+
+    async def prev_action(self, interaction: discord.Interaction):
+        await self.show(interaction, self.page - 1)
+
+    async def next_action(self, interaction: discord.Interaction):
+        await self.show(interaction, self.page + 1)
 
 
 @bot.command()
-async def checkroles(ctx):
-    """Проверить и обновить роли всех пользователей"""
-    if not ctx.author.guild_permissions.manage_messages:
-        await ctx.send("❌ Недостаточно прав, сталкер")
+async def top(ctx, window: str = None, page: int = 1):
+    """Топ по очкам: !top [day|week|month] [страница]"""
+    # !top 2 - вторая страница общего топа
+    if window is not None and window.isdigit():
+        window, page = None, int(window)
+
+    if window is not None:
+        window = window.lower()
+        if window not in LEDGER_WINDOWS:
+            await ctx.send(f"❌ Неизвестный период, доступны: "
+                           f"{', '.join(LEDGER_WINDOWS)}")
+            return
+
+    if not leaderboard_source(ctx.guild.id, window).leaderboard:
+        await ctx.send("❌ Нет данных об артефактах")
         return
 
-    points_data = load_points()
-    users_data = points_data.get("users", {})
+    # Страница берется из индекса рейтинга, без сортировки всех сталкеров
+    view = LeaderboardView(ctx.guild, page - 1, window)
+    await ctx.send(embed=await render_leaderboard(ctx.guild, view.page,
+                                                  window),
+                   view=view)
+
+
+@bot.command()
+async def rank(ctx, member: discord.Member = None):
+    """Место в рейтинге: !rank [@user]"""
+    member = member or ctx.author
+    user_id = str(member.id)
+    points_store = guild_registry.get(ctx.guild.id).points
 
-    updated_count = 0
-    for user_id, points in users_data.items():
-        member = ctx.guild.get_member(int(user_id))
-        if member:
-            await update_user_roles(member, points)
-            updated_count += 1
+    place = points_store.rank(user_id)
+    if place is None:
+        await ctx.send(f"❌ У сталкера {member.mention} нет артефактов")
+        return
 
-    await ctx.send(f"✅ Обновлены роли для {updated_count} сталкеров")
+    await ctx.send(
+        f"🏆 {member.mention}: **{place}** место из {len(points_store.users)}"
+        f" • {points_store.get(user_id)} артефактов")
 
 
-# Giveaway commands with prefix
 @bot.command()
-async def giveaway(ctx, duration: str, winners: int, *, prize: str):
-    """Создать розыгрыш: !giveaway 1h 1 Приз"""
+async def checkroles(ctx):
+    """Проверить и обновить роли всех пользователей"""
     if not ctx.author.guild_permissions.manage_messages:
         await ctx.send("❌ Недостаточно прав, сталкер")
         return
 
+    job_id = str(ctx.guild.id)
+    if job_id in role_sync_jobs:
+        await ctx.send(role_sync_status(role_sync_jobs[job_id]))
+        return
+
+    # Сначала по кэшу ролей находим, кому вообще нужны изменения
+    user_ids = await plan_role_sync(ctx.guild)
+    if not user_ids:
+        await ctx.send("✅ Роли всех сталкеров в порядке")
+        return
+
+    asyncio.create_task(
+        run_role_sync(ctx.guild, ctx.channel.id, user_ids, job_id))
+
+
+# Giveaway commands with prefix
+def parse_giveaway_args(duration: str, winners: int, prize: str) -> int:
+    """Проверить параметры розыгрыша, вернуть длительность в секундах"""
     try:
         seconds = parse_duration(duration)
     except ValueError as e:
-        await ctx.send(f"❌ Неверная длительность: {e}")
-        return
+        raise ValueError(f"Неверная длительность: {e}") from None
 
     if winners < 1:
-        await ctx.send("❌ Должен быть хотя бы 1 счастливчик")
-        return
+        raise ValueError("Должен быть хотя бы 1 счастливчик")
 
     if len(prize.strip()) < 2:
-        await ctx.send("❌ Трофей слишком скромный")
-        return
+        raise ValueError("Трофей слишком скромный")
+    return seconds
 
+
+async def start_giveaway(data: GuildData, channel: discord.abc.Messageable,
+                         creator_id: str, host_name: str, seconds: int,
+                         winners: int, prize: str) -> str:
+    """Опубликовать розыгрыш в канале и поставить таймер, вернуть его ID"""
     giveaway_id = str(uuid.uuid4())[:8]
     end_time = int(time.time()) + seconds
     flavor = pick_flavor()
 
     giveaway_data = {
         'id': giveaway_id,
-        'channel_id': ctx.channel.id,
-        'creator_id': str(ctx.author.id),
+        'channel_id': channel.id,
+        'creator_id': str(creator_id),
         'prize': prize,
         'winners': winners,
         'participants': [],
         'end_time': end_time,
         'ended': False,
         'flavor': flavor,
-        'host_name': ctx.author.display_name
+        'host_name': host_name
     }
 
     # Create embed
@@ -699,22 +1810,41 @@ async def giveaway(ctx, duration: str, winners: int, *, prize: str):
                     inline=True)
     embed.add_field(name="👥 Сталкеров", value="0", inline=True)
     embed.add_field(name="🏆 Счастливчиков", value=str(winners), inline=True)
-    embed.set_footer(
-        text=f"ID: {giveaway_id} • Нашел: {ctx.author.display_name}")
+    embed.set_footer(text=f"ID: {giveaway_id} • Нашел: {host_name}")
 
     view = GiveawayView(giveaway_id)
 
     # Send message
-    message = await ctx.send(embed=embed, view=view)
+    message = await outbox.submit(
+        channel.id, functools.partial(channel.send, embed=embed, view=view),
+        URGENT)
 
     # Save data
     giveaway_data['message_id'] = message.id
-    giveaways[giveaway_id] = giveaway_data
-    save_data()
+    data.giveaway_store.create(giveaway_id, giveaway_data)
+
+    # Start timer (buttons are routed by custom_id, no view to register)
+    giveaway_scheduler.schedule(giveaway_key(data.guild_id, giveaway_id),
+                                end_time)
+    return giveaway_id
 
-    # Register view and start timer
-    bot.add_view(GiveawayView(giveaway_id), message_id=message.id)
-    asyncio.create_task(giveaway_timer(giveaway_id))
+
+@bot.command()
+async def giveaway(ctx, duration: str, winners: int, *, prize: str):
+    """Создать розыгрыш: !giveaway 1h 1 Приз"""
+    if not ctx.author.guild_permissions.manage_messages:
+        await ctx.send("❌ Недостаточно прав, сталкер")
+        return
+
+    try:
+        seconds = parse_giveaway_args(duration, winners, prize)
+    except ValueError as e:
+        await ctx.send(f"❌ {e}")
+        return
+
+    await start_giveaway(guild_registry.get(ctx.guild.id), ctx.channel,
+                         ctx.author.id, ctx.author.display_name, seconds,
+                         winners, prize)
 
     # Delete command message
     try:
@@ -723,6 +1853,98 @@ async def giveaway(ctx, duration: str, winners: int, *, prize: str):
         pass
 
 
+def describe_schedule(schedule: dict) -> str:
+    if schedule.get('cron'):
+        return f"cron `{schedule['cron']}`"
+    if schedule.get('every'):
+        return f"каждые {format_time(schedule['every'])}"
+    return "один раз"
+
+
+@bot.command()
+async def gschedule(ctx, when: str, duration: str, winners: int, *,
+                    prize: str):
+    """Запланировать розыгрыш: !gschedule every:1d 1h 1 Приз"""
+    if not ctx.author.guild_permissions.manage_messages:
+        await ctx.send("❌ Недостаточно прав, сталкер")
+        return
+
+    try:
+        seconds = parse_giveaway_args(duration, winners, prize)
+    except ValueError as e:
+        await ctx.send(f"❌ {e}")
+        return
+
+    try:
+        schedule = parse_when(when, time.time(), SCHEDULE_TIMEZONE,
+                              parse_duration)
+    except ValueError as e:
+        await ctx.send(f"❌ Неверное расписание: {e}\n"
+                       "Примеры: `in:2h`, `at:2026-10-20T18:00`, "
+                       "`every:1d`, `every:7d@2026-10-20T18:00`, "
+                       "`\"cron:0 18 * * 5\"`")
+        return
+
+    data = guild_registry.get(ctx.guild.id)
+    schedule_id = str(uuid.uuid4())[:8]
+    schedule.update({
+        'channel_id': ctx.channel.id,
+        'creator_id': str(ctx.author.id),
+        'host_name': ctx.author.display_name,
+        'duration': seconds,
+        'winners': winners,
+        'prize': prize,
+        'runs': 0
+    })
+    data.schedules.put(schedule_id, schedule)
+    giveaway_scheduler.schedule(schedule_key(ctx.guild.id, schedule_id),
+                                schedule['next_start'])
+
+    await ctx.send(f"🗓 Хабар `{schedule_id}` запланирован"
+                   f" ({describe_schedule(schedule)}), первый запуск"
+                   f" <t:{schedule['next_start']}:R>")
+
+
+@bot.command()
+async def gschedules(ctx):
+    """Расписания розыгрышей сервера"""
+    if not ctx.author.guild_permissions.manage_messages:
+        await ctx.send("❌ Недостаточно прав, сталкер")
+        return
+
+    schedules = guild_registry.get(ctx.guild.id).schedules.schedules
+    if not schedules:
+        await ctx.send("❌ Расписаний нет")
+        return
+
+    embed = discord.Embed(title="🗓 Расписание хабара", color=0x2b5329)
+    upcoming = sorted(schedules.items(),
+                      key=lambda item: item[1]['next_start'])
+    for schedule_id, schedule in upcoming[:25]:
+        embed.add_field(
+            name=f"{schedule_id} • {schedule['prize'][:60]}",
+            value=(f"<#{schedule['channel_id']}> •"
+                   f" {describe_schedule(schedule)} •"
+                   f" {format_time(schedule['duration'])} •"
+                   f" следующий <t:{schedule['next_start']}:R>"),
+            inline=False)
+    await ctx.send(embed=embed)
+
+
+@bot.command()
+async def gunschedule(ctx, schedule_id: str):
+    """Удалить расписание: !gunschedule <id>"""
+    if not ctx.author.guild_permissions.manage_messages:
+        await ctx.send("❌ Недостаточно прав, сталкер")
+        return
+
+    if not guild_registry.get(ctx.guild.id).schedules.delete(schedule_id):
+        await ctx.send("❌ Расписание не найдено")
+        return
+    giveaway_scheduler.cancel(schedule_key(ctx.guild.id, schedule_id))
+    await ctx.send(f"✅ Расписание `{schedule_id}` удалено")
+
+
 @bot.command()
 async def gdelete(ctx, giveaway_id: str):
     """Удалить розыгрыш: !gdelete <id>"""
@@ -730,11 +1952,12 @@ async def gdelete(ctx, giveaway_id: str):
         await ctx.send("❌ Недостаточно прав, сталкер")
         return
 
-    if giveaway_id not in giveaways:
+    data = guild_registry.get(ctx.guild.id)
+    if giveaway_id not in data.giveaways:
         await ctx.send("❌ Розыгрыш не найден")
         return
 
-    giveaway = giveaways[giveaway_id]
+    giveaway = data.giveaways[giveaway_id]
 
     # Try to delete message
     try:
@@ -746,8 +1969,12 @@ async def gdelete(ctx, giveaway_id: str):
         pass
 
     # Remove from data
-    del giveaways[giveaway_id]
-    save_data()
+    data.giveaway_store.delete(giveaway_id)
+    giveaway_scheduler.cancel(giveaway_key(ctx.guild.id, giveaway_id))
+    embed_refresher.cancel(data, giveaway_id)
+    drop_entry_pool(data, giveaway_id)
+    drop_requirements(data, giveaway_id)
+    participant_pages.pop(giveaway_key(ctx.guild.id, giveaway_id), None)
 
     await ctx.send(f"✅ Хабар `{giveaway_id}` изъят Долгом")
 
@@ -765,26 +1992,26 @@ async def greroll(ctx, giveaway_id: str):
         await ctx.send("❌ Недостаточно прав, сталкер")
         return
 
-    if giveaway_id not in giveaways:
+    data = guild_registry.get(ctx.guild.id)
+    giveaway = await load_giveaway(data, giveaway_id)
+    if giveaway is None:
         await ctx.send("❌ Розыгрыш не найден")
         return
 
-    giveaway = giveaways[giveaway_id]
-
     if not giveaway.get('ended'):
         await ctx.send("❌ Хабар еще не поделен")
         return
 
-    participants = giveaway.get('participants', [])
     winners_count = giveaway['winners']
 
     # Select new winners
-    winners = []
-    if participants:
-        if len(participants) <= winners_count:
-            winners = participants
-        else:
-            winners = random.sample(participants, winners_count)
+    try:
+        eligible = await eligible_participants(data, giveaway_id, giveaway)
+    except (LookupError, asyncio.TimeoutError):
+        await ctx.send("❌ Не удалось проверить роли сталкеров,"
+                       " попробуйте позже")
+        return
+    winners = draw_winners(data, giveaway, winners_count, eligible)
 
     # Announce new winners
     if winners:
@@ -804,6 +2031,251 @@ async def greroll(ctx, giveaway_id: str):
         pass
 
 
+@bot.command()
+async def gweight(ctx, giveaway_id: str, curve: str, cap: int = None):
+    """Шансы по артефактам: !gweight <id> <none|linear|sqrt|log> [потолок]"""
+    if not ctx.author.guild_permissions.manage_messages:
+        await ctx.send("❌ Недостаточно прав, сталкер")
+        return
+
+    data = guild_registry.get(ctx.guild.id)
+    giveaway = data.giveaways.get(giveaway_id)
+    if giveaway is None:
+        await ctx.send("❌ Розыгрыш не найден")
+        return
+
+    if giveaway.get('ended'):
+        await ctx.send("❌ Розыгрыш завершен")
+        return
+
+    curve = curve.lower()
+    if curve != "none" and curve not in CURVES:
+        await ctx.send(f"❌ Неизвестная кривая, доступны: none, "
+                       f"{', '.join(CURVES)}")
+        return
+
+    if cap is not None and cap < 0:
+        await ctx.send("❌ Потолок не может быть отрицательным")
+        return
+
+    fields = {'weighting': None if curve == "none" else curve}
+    if cap is not None:
+        fields['weight_cap'] = cap
+    data.giveaway_store.update(giveaway_id, **fields)
+    drop_entry_pool(data, giveaway_id)
+    embed_refresher.schedule(data, giveaway_id)
+
+    if curve == "none":
+        await ctx.send(f"✅ В хабаре `{giveaway_id}` у всех равные шансы")
+    else:
+        cap = giveaway.get('weight_cap', ENTRY_WEIGHT_CAP)
+        await ctx.send(
+            f"✅ Шансы в хабаре `{giveaway_id}` зависят от артефактов ({curve}"
+            f"{f', потолок {cap}' if cap else ''})")
+
+
+@bot.command()
+async def greq(ctx, giveaway_id: str, rule: str = None, *, value: str = None):
+    """Условия участия: !greq <id> [points N | role[-] @роль |
+    norole[-] @роль | age 30d | clear]"""
+    if not ctx.author.guild_permissions.manage_messages:
+        await ctx.send("❌ Недостаточно прав, сталкер")
+        return
+
+    data = guild_registry.get(ctx.guild.id)
+    giveaway = data.giveaways.get(giveaway_id)
+    if giveaway is None:
+        await ctx.send("❌ Розыгрыш не найден")
+        return
+
+    if giveaway.get('ended'):
+        await ctx.send("❌ Розыгрыш завершен")
+        return
+
+    rules = EntryRequirements.from_dict(giveaway.get('requirements'))
+    rule = (rule or "").lower()
+    change = None
+
+    if rule == "points":
+        if value is None or not value.isdigit():
+            await ctx.send("❌ Укажите количество артефактов")
+            return
+        rules.min_points = int(value)
+    elif rule in ("role", "role-", "norole", "norole-"):
+        if not ctx.message.role_mentions:
+            await ctx.send("❌ Укажите роль упоминанием")
+            return
+        role_ids = {role.id for role in ctx.message.role_mentions}
+        attr = "roles" if rule.startswith("role") else "forbidden_roles"
+        current = getattr(rules, attr)
+        if rule.endswith("-"):
+            changed = current & role_ids
+            setattr(rules, attr, current - role_ids)
+            sign = "➖"
+        else:
+            changed = role_ids - current
+            setattr(rules, attr, current | role_ids)
+            sign = "➕"
+        if changed:
+            change = f"{sign} " + ", ".join(f"<@&{role_id}>"
+                                             for role_id in sorted(changed))
+        else:
+            change = "Без изменений"
+    elif rule == "age":
+        try:
+            rules.account_age = parse_duration(value or "")
+        except ValueError as e:
+            await ctx.send(f"❌ Неверная длительность: {e}")
+            return
+    elif rule == "clear":
+        rules = EntryRequirements()
+    elif rule:
+        await ctx.send("❌ Неизвестное условие, доступны: "
+                       "points, role, role-, norole, norole-, age, clear")
+        return
+
+    if rule:
+        # Joined entrants are re-checked in bulk at draw time
+        data.giveaway_store.update(giveaway_id,
+                                   requirements=rules.to_dict() or None)
+        drop_requirements(data, giveaway_id)
+        embed_refresher.schedule(data, giveaway_id)
+
+    lines = describe_requirements(rules)
+    summary = (f"📋 Условия хабара `{giveaway_id}`: " +
+               ("; ".join(lines) if lines else "нет"))
+    await ctx.send(f"{change}\n{summary}" if change else summary)
+
+
+@bot.command()
+async def ginfo(ctx, giveaway_id: str):
+    """История розыгрыша: !ginfo <id>"""
+    giveaway = await load_giveaway(guild_registry.get(ctx.guild.id),
+                                   giveaway_id)
+    if giveaway is None:
+        await ctx.send("❌ Розыгрыш не найден")
+        return
+
+    ended = giveaway.get('ended')
+    embed = discord.Embed(title=f"📜 Хабар `{giveaway_id}`",
+                          description=giveaway.get('flavor', ''),
+                          color=0x8B0000 if ended else 0x2b5329)
+    embed.add_field(name="🏆 Трофей", value=giveaway['prize'], inline=False)
+    embed.add_field(name="👥 Сталкеров",
+                    value=str(len(participants_of(giveaway))),
+                    inline=True)
+    embed.add_field(name="⏰ Завершение",
+                    value=f"<t:{int(giveaway['end_time'])}:f>",
+                    inline=True)
+
+    if ended:
+        winner_ids = giveaway.get('winner_ids', [])
+        embed.add_field(
+            name="🏆 Счастливчики",
+            value=", ".join(f"<@{uid}>" for uid in winner_ids)
+            or "❌ Никто не рискнул",
+            inline=False)
+    embed.set_footer(
+        text=f"Нашел: {giveaway.get('host_name', 'Неизвестный сталкер')}")
+
+    await ctx.send(embed=embed)
+
+
+@bot.command()
+async def gqueue(ctx):
+    """Очередь завершения розыгрышей: !gqueue"""
+    if not ctx.author.guild_permissions.manage_messages:
+        await ctx.send("❌ Недостаточно прав, сталкер")
+        return
+
+    # Only this guild's giveaways, not the shared timer of all guilds; the
+    # timer has the real deadline (ends can be postponed past end_time)
+    giveaways = guild_registry.get(ctx.guild.id).giveaways
+    prefix = giveaway_key(ctx.guild.id, "")
+    active = giveaway_scheduler.queue(prefix=prefix)
+    if not active:
+        await ctx.send("❌ Активных розыгрышей нет")
+        return
+
+    embed = discord.Embed(title=f"⏰ Очередь хабара ({len(active)})",
+                          color=0x2b5329)
+    for deadline, key in active[:10]:
+        giveaway_id = key[len(prefix):]
+        giveaway = giveaways.get(giveaway_id, {})
+        value = f"<t:{int(deadline)}:R>"
+        if deadline > giveaway.get('end_time', deadline):
+            value += " (отложен)"
+        embed.add_field(name=f"`{giveaway_id}` • {giveaway.get('prize', '?')}",
+                        value=value,
+                        inline=False)
+
+    await ctx.send(embed=embed)
+
+
+def format_ms(seconds) -> str:
+    return "—" if seconds is None else f"{seconds * 1000:.1f}ms"
+
+
+def histogram_summary(histogram, limit: int = 8) -> str:
+    """Самые частые ряды гистограммы: количество, p50, p99"""
+    rows = sorted(histogram.series(), key=lambda row: -row[1])[:limit]
+    lines = []
+    for labels, count, _ in rows:
+        name = " ".join(labels.values())
+        lines.append(f"`{name}` ×{count} • p50 "
+                     f"{format_ms(histogram.quantile(0.5, **labels))} • p99 "
+                     f"{format_ms(histogram.quantile(0.99, **labels))}")
+    return "\n".join(lines) or "—"
+
+
+@bot.command()
+async def stats(ctx):
+    """Метрики бота: !stats"""
+    if not ctx.author.guild_permissions.administrator:
+        await ctx.send("❌ Недостаточно прав, сталкер")
+        return
+
+    errors = (sum(COMMAND_ERRORS.values.values()) +
+              sum(INTERACTION_ERRORS.values.values()))
+    embed = discord.Embed(title="📈 Состояние бота", color=0x2b5329)
+    embed.add_field(name="⏱ Запущен", value=f"<t:{STARTED_AT}:R>", inline=True)
+    embed.add_field(name="🌀 Задержка цикла",
+                    value=format_ms(LOOP_LAG.get()),
+                    inline=True)
+    embed.add_field(name="❌ Ошибок", value=str(errors), inline=True)
+    embed.add_field(
+        name="🚀 Старт",
+        value=(f"данные {format_ms(STARTUP_SECONDS.get(phase='load'))}, "
+               f"таймеры {format_ms(STARTUP_SECONDS.get(phase='schedule'))}, "
+               f"до готовности {format_ms(STARTUP_SECONDS.get(phase='ready'))}"
+               f"\nв очереди завершения: {len(giveaway_scheduler)}"
+               f" (просрочено {giveaway_scheduler.overdue()})"),
+        inline=False)
+    embed.add_field(name="⌨️ Команды",
+                    value=histogram_summary(COMMAND_SECONDS),
+                    inline=False)
+    embed.add_field(name="🔘 Кнопки",
+                    value=histogram_summary(INTERACTION_SECONDS),
+                    inline=False)
+    embed.add_field(
+        name=(f"📤 Очередь отправки ({len(outbox)},"
+              f" вытеснено {int(sum(OUTBOX_DROPPED.values.values()))})"),
+        value=histogram_summary(OUTBOX_WAIT),
+        inline=False)
+    embed.add_field(name="💾 Запись",
+                    value=histogram_summary(PERSIST_SECONDS),
+                    inline=False)
+    embed.add_field(
+        name=f"🌐 Discord API (ошибок {sum(DISCORD_ERRORS.values.values())})",
+        value=histogram_summary(DISCORD_SECONDS, limit=6),
+        inline=False)
+    if METRICS_PORT:
+        embed.set_footer(
+            text=f"Prometheus: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+    await ctx.send(embed=embed)
+
+
 # Help command
 @bot.command()
 async def help(ctx):
@@ -813,8 +2285,15 @@ async def help(ctx):
     embed.add_field(
         name="🎉 Команды хабара",
         value=("`!giveaway длительность победители трофей` - Найти хабар\n"
+               "`!gschedule когда длительность победители трофей` - По расписанию\n"
+               "`!gschedules` / `!gunschedule id` - Расписания\n"
                "`!gdelete id_розыгрыша` - Изъять хабар\n"
                "`!greroll id_розыгрыша` - Передел хабара\n"
+               "`!gweight id кривая [потолок]` - Шансы по артефактам\n"
+               "`!greq id [points|role|norole|age|clear] значение` - Условия участия\n"
+               "`!greq id role-|norole- @роль` - Убрать роль из условий\n"
+               "`!gqueue` - Очередь завершения хабара\n"
+               "`!ginfo id_розыгрыша` - История хабара\n"
                "*(требуются права на управление сообщениями)*"),
         inline=False)
 
@@ -822,52 +2301,155 @@ async def help(ctx):
         name="📊 Команды артефактов",
         value=("`!add @user количество` - Выдать артефакты\n"
                "`!remove @user количество` - Изъять артефакты\n"
+               "`!addmany количество @user ...` - Выдать многим (или CSV/JSONL)\n"
                "`!setreward @role количество` - Установить награду\n"
                "`!rewards` - Список наград\n"
-               "`!top` - Топ сталкеров\n"
+               "`!top [week|month] [страница]` - Топ сталкеров\n"
+               "`!rank [@user]` - Место в рейтинге\n"
                "`!checkroles` - Обновить роли всех сталкеров\n"
                "*(требуются права на управление сообщениями)*"),
         inline=False)
 
+    embed.add_field(name="📈 Служебные",
+                    value=("`!stats` - Метрики бота\n"
+                           "*(требуются права администратора)*"),
+                    inline=False)
+
     await ctx.send(embed=embed)
 
 
+async def start_scheduler_when_ready():
+    """Завершать хабары только после READY.
+
+    setup_hook runs before the gateway connects: channels and members are
+    not cached yet, so overdue ends would check entry requirements against
+    an empty member cache.
+    """
+    await bot.wait_until_ready()
+    giveaway_scheduler.start()
+
+
 # Bot events
+@bot.event
+async def setup_hook():
+    # Runs once per process, unlike on_ready which fires on every reconnect
+    active_count = load_data()
+    overdue = giveaway_scheduler.overdue()
+    print(f"🎯 Восстановлено активных хабаров: {active_count}"
+          f" (серверов: {len(guild_registry)})")
+    if overdue:
+        print(f"⏳ Просроченных хабаров: {overdue}"
+              f" (завершаем по {GIVEAWAY_END_CONCURRENCY})")
+
+    # Render stops the service with SIGTERM: close the bot so bot.run()
+    # returns and save_data() in __main__ writes what is still buffered
+    try:
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGTERM, lambda: asyncio.create_task(bot.close()))
+    except NotImplementedError:
+        # Windows event loops have no signal handlers
+        pass
+
+    # Background flushers for points and journal compaction of every guild
+    guild_registry.start()
+    asyncio.create_task(start_scheduler_when_ready())
+    asyncio.create_task(archive_loop())
+    if ACTIVITY_POINTS > 0:
+        asyncio.create_task(activity_loop())
+    if VOICE_POINTS > 0:
+        asyncio.create_task(voice_loop())
+
+    # Metrics: every REST call, loop lag and the Prometheus endpoint
+    metrics.instrument_http(bot.http)
+    asyncio.create_task(metrics.monitor_loop_lag())
+    if METRICS_PORT:
+        try:
+            await metrics.serve(METRICS_HOST, METRICS_PORT)
+            print(f"📈 Метрики: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+        except OSError as e:
+            print(f"❌ Не удалось открыть порт метрик: {e}")
+
+
+@bot.before_invoke
+async def start_command_timer(ctx):
+    ctx.started_at = time.perf_counter()
+
+
+@bot.after_invoke
+async def record_command_time(ctx):
+    # Runs after every invoked command, including failed ones
+    name = ctx.command.qualified_name
+    COMMAND_SECONDS.observe(time.perf_counter() - ctx.started_at,
+                            command=name)
+    if ctx.command_failed:
+        COMMAND_ERRORS.inc(command=name)
+
+
 @bot.event
 async def on_ready():
-    print(f"✅ Бот запущен как {bot.user.name}")
+    # Also fires after every gateway reconnect: only cheap, idempotent work
+    if not STARTUP_SECONDS.get(phase="ready"):
+        ready = time.perf_counter() - STARTED_PERF
+        STARTUP_SECONDS.set(ready, phase="ready")
+        print(f"✅ Бот запущен как {bot.user.name} за {ready:.1f} с"
+              f" (данные {format_ms(STARTUP_SECONDS.get(phase='load'))},"
+              f" таймеры {format_ms(STARTUP_SECONDS.get(phase='schedule'))})")
+    else:
+        print(f"🔁 Переподключение: {bot.user.name}")
 
-    # Load data
-    load_data()
+    if VOICE_POINTS > 0:
+        for guild in bot.guilds:
+            reconcile_voice(guild)
 
-    # Restore active giveaways
-    active_count = 0
-    current_time = time.time()
+    resume_role_sync()
 
-    for giveaway_id, giveaway in giveaways.items():
-        if not giveaway.get('ended'):
-            # Register view
-            try:
-                bot.add_view(GiveawayView(giveaway_id),
-                             message_id=giveaway['message_id'])
-            except:
-                pass
-
-            # Check if ended
-            if giveaway['end_time'] <= current_time:
-                asyncio.create_task(end_giveaway(giveaway_id))
-            else:
-                asyncio.create_task(giveaway_timer(giveaway_id))
-                active_count += 1
 
-    print(f"🎯 Восстановлено активных хабаров: {active_count}")
+@bot.event
+async def on_guild_join(guild: discord.Guild):
+    guild_registry.get(guild.id)
+    if VOICE_POINTS > 0:
+        reconcile_voice(guild)
+
+
+@bot.listen("on_message")
+async def accrue_activity(message: discord.Message):
+    # Hot path: in-memory only, points are written by activity_loop
+    if (ACTIVITY_POINTS <= 0 or message.guild is None or message.author.bot
+            or message.content.startswith(bot.command_prefix)):
+        return
+    activity.record(message.guild.id, message.author.id, time.time())
+
+
+@bot.listen("on_raw_member_remove")
+async def forget_member(payload: discord.RawMemberRemoveEvent):
+    member_cache.discard(payload.guild_id, payload.user.id)
+
+
+@bot.listen("on_voice_state_update")
+async def track_voice(member: discord.Member, before: discord.VoiceState,
+                      after: discord.VoiceState):
+    # Mute, deafen and channel moves all land here; points come from voice_loop
+    if VOICE_POINTS <= 0:
+        return
+    voice.update(member.guild.id, member.id, voice_eligible(member, after),
+                 time.time())
+
+
+@bot.event
+async def on_interaction(interaction: discord.Interaction):
+    # Giveaway buttons of every giveaway go through one dispatcher
+    await dispatch_giveaway_button(interaction)
 
 
 # Run bot
 if __name__ == "__main__":
     print("🚀 Запуск бота...")
     print("💡 Убедитесь, что переменная TOKEN установлена!")
-    bot.run(TOKEN)
+    try:
+        bot.run(TOKEN)
+    finally:
+        # Сохраняем несохраненные данные при остановке
+        save_data()
 
 
 
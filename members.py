@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+On-demand member resolution for bots without the full member cache
+"""
+
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+import discord
+
+# Gateway "Request Guild Members" accepts at most 100 user IDs
+QUERY_BATCH = 100
+
+
+class MemberCache:
+    """Members looked up by ID, kept in a small LRU with TTL.
+
+    With lazy=False the bot caches every member itself and lookups go
+    straight to guild.get_member(). With lazy=True (no chunking, no member
+    cache) resolve() asks the gateway for just the missing IDs, up to 100
+    per request, and remembers the result - including "not a member" - for
+    ttl seconds in at most size entries.
+    """
+
+    def __init__(self, lazy: bool, size: int = 10000, ttl: float = 600):
+        self.lazy = lazy
+        self.size = size
+        self.ttl = ttl
+        # (guild_id, user_id) -> (expires, member or None)
+        self.entries: "OrderedDict[Tuple[int, int], tuple]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _lookup(self, guild: discord.Guild, user_id: int):
+        """(найден ли в кэше, участник)"""
+        member = guild.get_member(user_id)
+        if member is not None or not self.lazy:
+            return True, member
+        key = (guild.id, user_id)
+        entry = self.entries.get(key)
+        if entry is None:
+            return False, None
+        if entry[0] <= time.monotonic():
+            del self.entries[key]
+            return False, None
+        self.entries.move_to_end(key)
+        return True, entry[1]
+
+    def get(self, guild: discord.Guild, user_id) -> Optional[discord.Member]:
+        """Участник из кэша, без запросов"""
+        return self._lookup(guild, int(user_id))[1]
+
+    def put(self, guild_id: int, user_id: int,
+            member: Optional[discord.Member]):
+        if not self.lazy:
+            return
+        key = (guild_id, user_id)
+        self.entries[key] = (time.monotonic() + self.ttl, member)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def discard(self, guild_id: int, user_id: int):
+        self.entries.pop((guild_id, user_id), None)
+
+    async def resolve(self,
+                      guild: discord.Guild,
+                      user_ids: Iterable,
+                      strict: bool = False) -> Dict[int, discord.Member]:
+        """Участники сервера по ID (кого нет на сервере - пропускаются).
+
+        A batch whose lookup times out is skipped, or with strict=True the
+        TimeoutError is raised: absent then means "not known", not "left".
+        """
+        members: Dict[int, discord.Member] = {}
+        missing = []
+        for user_id in dict.fromkeys(map(int, user_ids)):
+            found, member = self._lookup(guild, user_id)
+            if member is not None:
+                members[user_id] = member
+            elif not found:
+                missing.append(user_id)
+
+        for start in range(0, len(missing), QUERY_BATCH):
+            batch = missing[start:start + QUERY_BATCH]
+            try:
+                fetched = await guild.query_members(user_ids=batch,
+                                                   limit=len(batch),
+                                                   cache=False)
+            except asyncio.TimeoutError:
+                print(f"Member lookup timed out ({len(batch)} IDs)")
+                if strict:
+                    raise
+                continue
+            by_id = {member.id: member for member in fetched}
+            for user_id in batch:
+                member = by_id.get(user_id)
+                self.put(guild.id, user_id, member)
+                if member is not None:
+                    members[user_id] = member
+        return members
+
+    async def fetch(self, guild: discord.Guild,
+                    user_id) -> Optional[discord.Member]:
+        return (await self.resolve(guild, (user_id, ))).get(int(user_id))
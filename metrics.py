@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+In-process metrics: counters, gauges and histograms with a Prometheus
+text-format endpoint
+"""
+
+import time
+import asyncio
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Seconds; from a dict lookup up to a slow Discord request
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric:
+    """One metric family; values are kept per tuple of label values"""
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values: Dict[tuple, object] = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def _format_labels(self, key: tuple, extra: str = "") -> str:
+        parts = [
+            f'{label}="{_escape(value)}"'
+            for label, value in zip(self.labels, key)
+        ]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} {self.type}"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{self._format_labels(key)} {value}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+    def get(self, **labels) -> float:
+        return self.values.get(self._key(labels), 0)
+
+
+class Histogram(Metric):
+    """Fixed buckets; observe() is one bisect and two additions"""
+
+    type = "histogram"
+
+    def __init__(self,
+                 name: str,
+                 help: str,
+                 labels: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _series(self, key: tuple) -> list:
+        series = self.values.get(key)
+        if series is None:
+            # [per-bucket counts (+Inf last), sum, count]
+            series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        return series
+
+    def observe(self, value: float, **labels):
+        series = self._series(self._key(labels))
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def series(self) -> List[Tuple[dict, int, float]]:
+        """(метки, количество, сумма) по всем рядам"""
+        return [(dict(zip(self.labels, key)), count, total)
+                for key, (_, total, count) in self.values.items()]
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """Оценка квантиля по бакетам (как histogram_quantile)"""
+        series = self.values.get(self._key(labels))
+        if not series or not series[2]:
+            return None
+        counts, _, count = series
+        rank = q * count
+        seen = 0
+        for i, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} {self.type}"]
+        for key, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (None, ), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound is None else repr(bound)
+                bucket_labels = self._format_labels(key, f'le="{le}"')
+                lines.append(
+                    f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {count}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels=()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels=()) -> Gauge:
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels=(), **kwargs) -> Histogram:
+        return self.register(Histogram(name, help, labels, **kwargs))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Metrics of the bot, shared by main.py and storage.py
+COMMAND_SECONDS = REGISTRY.histogram("bot_command_duration_seconds",
+                                     "Prefix command handling time",
+                                     ["command"])
+COMMAND_ERRORS = REGISTRY.counter("bot_command_errors_total",
+                                  "Prefix commands that raised", ["command"])
+INTERACTION_SECONDS = REGISTRY.histogram(
+    "bot_interaction_duration_seconds", "Button callback handling time",
+    ["action"])
+INTERACTION_ERRORS = REGISTRY.counter("bot_interaction_errors_total",
+                                      "Button callbacks that raised",
+                                      ["action"])
+PERSIST_SECONDS = REGISTRY.histogram("bot_persistence_duration_seconds",
+                                     "Time spent writing data", ["op"])
+PERSIST_BYTES = REGISTRY.counter("bot_persistence_bytes_total",
+                                 "Bytes written", ["op"])
+DISCORD_SECONDS = REGISTRY.histogram("bot_discord_request_duration_seconds",
+                                     "Discord REST request time",
+                                     ["method", "route"])
+DISCORD_ERRORS = REGISTRY.counter("bot_discord_errors_total",
+                                  "Failed Discord REST requests",
+                                  ["method", "route", "status"])
+LOOP_LAG = REGISTRY.gauge("bot_event_loop_lag_seconds",
+                          "How late the event loop woke up a sleeping task")
+OUTBOX_WAIT = REGISTRY.histogram("bot_outbox_wait_seconds",
+                                 "Time a message waited in the outbox",
+                                 ["priority"])
+OUTBOX_DROPPED = REGISTRY.counter("bot_outbox_dropped_total",
+                                  "Queued edits superseded by newer ones",
+                                  ["priority"])
+STARTUP_SECONDS = REGISTRY.gauge("bot_startup_duration_seconds",
+                                 "Time spent in each startup phase",
+                                 ["phase"])
+
+
+def instrument_http(http):
+    """Обернуть HTTPClient.request: время и ошибки по маршрутам Discord"""
+    request = http.request
+
+    async def timed_request(route, **kwargs):
+        # route.path is the template ("/channels/{channel_id}/messages"),
+        # so the label set stays small
+        labels = {"method": route.method, "route": route.path}
+        start = time.perf_counter()
+        try:
+            return await request(route, **kwargs)
+        except Exception as e:
+            DISCORD_ERRORS.inc(status=getattr(e, "status", "error"), **labels)
+            raise
+        finally:
+            DISCORD_SECONDS.observe(time.perf_counter() - start, **labels)
+
+    http.request = timed_request
+
+
+async def monitor_loop_lag(interval: float = 1.0):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        LOOP_LAG.set(max(0.0, time.perf_counter() - start - interval))
+
+
+async def serve(host: str, port: int, registry: Registry = REGISTRY):
+    """HTTP-эндпоинт /metrics в формате Prometheus"""
+
+    async def handle(reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            # Headers are not needed, just drain them
+            while (await asyncio.wait_for(reader.readline(), 5)).strip():
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[1].split("?")[0] == "/metrics":
+                status = "200 OK"
+                body = registry.render().encode("utf-8")
+            else:
+                status = "404 Not Found"
+                body = b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode("latin-1") + body)
+            await writer.drain()
+        except Exception:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Data migrations
+
+Usage:
+  python3 migrate.py sqlite <guild_id> [data_dir]
+      One-shot import of giveaways.json / points.json of the guild
+      (data_dir/guilds/<guild_id>) into bot.db next to them
+  python3 migrate.py guild <guild_id> [data_dir]
+      Move the old single-guild data in data_dir to guilds/<guild_id>
+"""
+
+import os
+import sys
+
+from storage import open_sqlite, import_json, migrate_flat_data
+
+
+def default_data_dir() -> str:
+    return os.getenv("DATA_DIR", "/opt/render/project/data")
+
+
+def guild_dir(guild_id: str, data_dir: str) -> str:
+    return os.path.join(data_dir, "guilds", str(int(guild_id)))
+
+
+def migrate_guild(guild_id: str, data_dir: str):
+    moved = migrate_flat_data(data_dir, guild_dir(guild_id, data_dir))
+    if not moved:
+        print(f"❌ В {data_dir} нет данных старого формата")
+        return
+    print(f"✅ Перенесено на сервер {guild_id}: {', '.join(moved)}")
+
+
+def migrate_sqlite(guild_id: str, data_dir: str):
+    directory = guild_dir(guild_id, data_dir)
+    giveaways_path = os.path.join(directory, "giveaways.json")
+    points_path = os.path.join(directory, "points.json")
+    if not any(map(os.path.exists, (giveaways_path, points_path))):
+        print(f"❌ В {directory} нет данных для импорта")
+        return
+
+    database = os.path.join(directory, "bot.db")
+    conn = open_sqlite(database)
+    users, giveaways = import_json(conn, giveaways_path, points_path)
+    conn.close()
+
+    print(f"✅ Импортировано: {users} сталкеров, {giveaways} розыгрышей")
+    print(f"💡 Запустите бота с STORAGE_BACKEND=sqlite (база: {database})")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] in ("guild", "sqlite"):
+        migrate = migrate_guild if sys.argv[1] == "guild" else migrate_sqlite
+        migrate(sys.argv[2],
+                sys.argv[3] if len(sys.argv) > 3 else default_data_dir())
+    else:
+        print(__doc__)
+        sys.exit(1)
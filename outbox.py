@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Outbound message queue: per-channel budgets and priorities
+"""
+
+import time
+import heapq
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional
+
+from metrics import OUTBOX_DROPPED, OUTBOX_WAIT
+from rolesync import TokenBucket
+
+# Priorities, lower is sent first
+URGENT = 0  # winner announcements, command replies
+NORMAL = 1  # final state of a message (ended giveaway, job result)
+LOW = 2  # cosmetic refreshes (participant counts, progress)
+
+PRIORITY_NAMES = {URGENT: "urgent", NORMAL: "normal", LOW: "low"}
+
+
+class _Request:
+    __slots__ = ("priority", "seq", "send", "future", "key", "queued_at")
+
+    def __init__(self, priority: int, seq: int,
+                 send: Callable[[], Awaitable], future: asyncio.Future,
+                 key: Optional[Hashable]):
+        self.priority = priority
+        self.seq = seq
+        self.send = send
+        self.future = future
+        self.key = key
+        self.queued_at = time.monotonic()
+
+    def __lt__(self, other: "_Request") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class _Lane:
+
+    def __init__(self, rate: float, burst: int):
+        self.bucket = TokenBucket(rate, burst)
+        self.heap: List[_Request] = []
+        self.keyed: Dict[Hashable, _Request] = {}
+        self.task: Optional[asyncio.Task] = None
+
+
+class _Channel:
+    """New messages (POST) and edits (PATCH) have separate rate limits"""
+
+    def __init__(self, rate: float, burst: int):
+        self.sends = _Lane(rate, burst)
+        self.edits = _Lane(rate, burst)
+
+    def lanes(self):
+        return (self.sends, self.edits)
+
+
+class Outbox:
+    """Sends channel messages and edits through one queue per channel.
+
+    Every channel has two lanes, one for new messages and one for edits,
+    since Discord limits them separately (about 5 per 5 seconds each). A
+    lane has its own token bucket and priority heap; one worker per busy
+    lane sends the most important request first, FIFO within a priority. A request with a key (usually the message ID of an edit)
+    replaces a pending request with the same key and equal or lower
+    priority: the older one is dropped and its caller gets None. A keyed
+    request that would replace a more important one is dropped instead.
+    """
+
+    def __init__(self, rate: float = 1.0, burst: int = 5):
+        self.rate = rate
+        self.burst = burst
+        self.channels: Dict[int, _Channel] = {}
+        self._seq = 0
+
+    def __len__(self) -> int:
+        return sum(1 for channel in self.channels.values()
+                   for lane in channel.lanes() for request in lane.heap
+                   if not request.future.done())
+
+    def submit(self,
+               channel_id: int,
+               send: Callable[[], Awaitable],
+               priority: int = NORMAL,
+               key: Optional[Hashable] = None,
+               edit: bool = False) -> asyncio.Future:
+        """Поставить запрос в очередь канала, future с результатом send().
+
+        edit=True - send() edits an existing message (the edit lane).
+        """
+        future = asyncio.get_running_loop().create_future()
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            channel = self.channels[channel_id] = _Channel(
+                self.rate, self.burst)
+        lane = channel.edits if edit else channel.sends
+
+        if key is not None:
+            pending = lane.keyed.get(key)
+            if pending is not None and not pending.future.done():
+                if pending.priority < priority:
+                    self._drop(future, priority)
+                    return future
+                self._drop(pending.future, pending.priority)
+
+        self._seq += 1
+        request = _Request(priority, self._seq, send, future, key)
+        heapq.heappush(lane.heap, request)
+        if key is not None:
+            lane.keyed[key] = request
+
+        if lane.task is None or lane.task.done():
+            lane.task = asyncio.create_task(self._drain(lane))
+        return future
+
+    @staticmethod
+    def _drop(future: asyncio.Future, priority: int):
+        if not future.done():
+            future.set_result(None)
+        OUTBOX_DROPPED.inc(priority=PRIORITY_NAMES.get(priority, priority))
+
+    def _pop(self, lane: _Lane) -> Optional[_Request]:
+        heap = lane.heap
+        while heap:
+            request = heapq.heappop(heap)
+            if request.key is not None and lane.keyed.get(
+                    request.key) is request:
+                del lane.keyed[request.key]
+            # Superseded, or the caller gave up waiting
+            if not request.future.done():
+                return request
+        return None
+
+    async def _drain(self, lane: _Lane):
+        while lane.heap:
+            # Take the token first: requests queued meanwhile still compete
+            await lane.bucket.acquire()
+            request = self._pop(lane)
+            if request is None:
+                break
+            OUTBOX_WAIT.observe(time.monotonic() - request.queued_at,
+                                priority=PRIORITY_NAMES.get(
+                                    request.priority, request.priority))
+            try:
+                result = await request.send()
+            except Exception as e:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            else:
+                if not request.future.done():
+                    request.future.set_result(result)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Start times of scheduled and recurring giveaways
+"""
+
+from datetime import datetime, timedelta, tzinfo
+from typing import Callable, Optional, Set
+
+# minute, hour, day of month, month, day of week (0 = Sunday, 7 = Sunday)
+CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+# How far ahead Cron.next_after() looks for a matching day
+CRON_HORIZON_DAYS = 5 * 366
+
+
+class Cron:
+    """Five-field cron expression: lists, ranges and steps (*/15, 1-5)"""
+
+    def __init__(self, expression: str):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(
+                "cron needs 5 fields: minute hour day month weekday")
+        self.expression = " ".join(parts)
+        (self.minutes, self.hours, self.days, self.months,
+         weekdays) = (self._field(part, low, high)
+                      for part, (low, high) in zip(parts, CRON_FIELDS))
+        self.weekdays = {day % 7 for day in weekdays}
+        # Standard cron: if both day fields are restricted, either matches
+        self.any_day = parts[2] == "*"
+        self.any_weekday = parts[4] == "*"
+        self._minutes = sorted(self.minutes)
+        self._hours = sorted(self.hours)
+
+    @staticmethod
+    def _field(part: str, low: int, high: int) -> Set[int]:
+        values = set()
+        for item in part.split(","):
+            step = 1
+            if "/" in item:
+                item, step_text = item.split("/", 1)
+                step = int(step_text)
+                if step < 1:
+                    raise ValueError(f"bad step: {part}")
+            if item == "*":
+                start, end = low, high
+            elif "-" in item:
+                start, end = map(int, item.split("-", 1))
+            else:
+                start = end = int(item)
+            if not low <= start <= end <= high:
+                raise ValueError(f"out of range: {part}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, day: datetime) -> bool:
+        if day.month not in self.months:
+            return False
+        in_month = day.day in self.days
+        # Python: Monday = 0, cron: Sunday = 0
+        in_week = (day.weekday() + 1) % 7 in self.weekdays
+        if self.any_day:
+            return in_week
+        if self.any_weekday:
+            return in_month
+        return in_month or in_week
+
+    def next_after(self, after: float, tz: tzinfo) -> Optional[float]:
+        """Первое совпадение строго после after (unix time) или None"""
+        start = datetime.fromtimestamp(after, tz).replace(second=0,
+                                                          microsecond=0)
+        day = start.replace(hour=0, minute=0)
+        for _ in range(CRON_HORIZON_DAYS):
+            if self._day_matches(day):
+                for hour in self._hours:
+                    for minute in self._minutes:
+                        candidate = day.replace(hour=hour, minute=minute)
+                        if candidate.timestamp() > after:
+                            return candidate.timestamp()
+            # Wall-clock arithmetic: stays at local midnight across DST
+            day += timedelta(days=1)
+        return None
+
+
+def parse_datetime(text: str, tz: tzinfo) -> float:
+    """YYYY-MM-DDTHH:MM (или через пробел) в часовом поясе tz"""
+    try:
+        moment = datetime.fromisoformat(text.strip())
+    except ValueError:
+        raise ValueError(f"bad date: {text}") from None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=tz)
+    return moment.timestamp()
+
+
+def parse_when(spec: str, now: float, tz: tzinfo,
+               parse_duration: Callable[[str], int]) -> dict:
+    """Разобрать расписание в поля определения.
+
+    in:2h, at:2026-10-20T18:00 - once;
+    every:1d[@2026-10-20T18:00] - every interval, from the given time;
+    cron:0 18 * * 5 - on cron matches.
+    Returns {"next_start", "every"?, "cron"?}.
+    """
+    kind, _, value = spec.partition(":")
+    kind = kind.strip().lower()
+    value = value.strip()
+    if kind == "in":
+        return {"next_start": int(now) + parse_duration(value)}
+    if kind == "at":
+        start = parse_datetime(value, tz)
+        if start <= now:
+            raise ValueError("this time has already passed")
+        return {"next_start": int(start)}
+    if kind == "every":
+        interval, _, anchor = value.partition("@")
+        every = parse_duration(interval)
+        if every < 60:
+            raise ValueError("interval must be at least 1m")
+        start = parse_datetime(anchor, tz) if anchor else now + every
+        schedule = {"every": every, "next_start": int(start)}
+        schedule["next_start"] = next_start(schedule, now - 1, tz)
+        return schedule
+    if kind == "cron":
+        cron = Cron(value)
+        start = cron.next_after(now, tz)
+        if start is None:
+            raise ValueError("cron expression never matches")
+        return {"cron": cron.expression, "next_start": int(start)}
+    raise ValueError(f"unknown schedule: {spec}")
+
+
+def next_start(schedule: dict, after: float, tz: tzinfo) -> Optional[int]:
+    """Следующий запуск после after (None - больше не запускать).
+
+    Runs missed while the bot was offline are skipped, the schedule resumes
+    at its next regular time.
+    """
+    if schedule.get("cron"):
+        start = Cron(schedule["cron"]).next_after(after, tz)
+        return None if start is None else int(start)
+    every = schedule.get("every")
+    if not every:
+        return None
+    start = schedule["next_start"]
+    if start > after:
+        return start
+    return int(start + ((after - start) // every + 1) * every)
+
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Giveaway entry requirements
+"""
+
+import time
+from typing import Callable, Collection, Iterable, List, Optional
+
+# Discord snowflakes carry their creation time (ms since 2015-01-01)
+DISCORD_EPOCH = 1420070400000
+
+
+def account_created(user_id) -> float:
+    """Время создания аккаунта по его ID, без запросов"""
+    return ((int(user_id) >> 22) + DISCORD_EPOCH) / 1000
+
+
+class EntryRequirements:
+    """Who may enter a giveaway.
+
+    min_points - artifact balance, roles - at least one of them,
+    forbidden_roles - none of them, account_age - seconds since the account
+    was created. Every rule is checked against in-memory data only: the
+    points store, the roles of the member and the user ID.
+    """
+
+    __slots__ = ("min_points", "roles", "forbidden_roles", "account_age")
+
+    def __init__(self,
+                 min_points: int = 0,
+                 roles: Iterable[int] = (),
+                 forbidden_roles: Iterable[int] = (),
+                 account_age: int = 0):
+        self.min_points = min_points
+        self.roles = frozenset(map(int, roles))
+        self.forbidden_roles = frozenset(map(int, forbidden_roles))
+        self.account_age = account_age
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> "EntryRequirements":
+        data = data or {}
+        return cls(data.get("min_points", 0), data.get("roles", ()),
+                   data.get("forbidden_roles", ()),
+                   data.get("account_age", 0))
+
+    def to_dict(self) -> dict:
+        """Только заданные правила (для giveaways.json)"""
+        data = {}
+        if self.min_points:
+            data["min_points"] = self.min_points
+        if self.roles:
+            data["roles"] = sorted(self.roles)
+        if self.forbidden_roles:
+            data["forbidden_roles"] = sorted(self.forbidden_roles)
+        if self.account_age:
+            data["account_age"] = self.account_age
+        return data
+
+    def __bool__(self) -> bool:
+        return bool(self.min_points or self.roles or self.forbidden_roles
+                    or self.account_age)
+
+    @property
+    def needs_roles(self) -> bool:
+        return bool(self.roles or self.forbidden_roles)
+
+    def failure(self,
+                user_id,
+                points: int,
+                role_ids: Optional[Collection[int]] = None,
+                now: Optional[float] = None) -> Optional[str]:
+        """Первое нарушенное правило ("points", "age", "role", "forbidden")
+        или None. Без role_ids роли не проверяются."""
+        if points < self.min_points:
+            return "points"
+        if self.account_age:
+            now = time.time() if now is None else now
+            if now - account_created(user_id) < self.account_age:
+                return "age"
+        if role_ids is not None:
+            if self.roles and self.roles.isdisjoint(role_ids):
+                return "role"
+            if not self.forbidden_roles.isdisjoint(role_ids):
+                return "forbidden"
+        return None
+
+    def filter(self, user_ids: Iterable[int], points: Callable[[str], int],
+               now: Optional[float] = None) -> List[int]:
+        """Кто проходит правила без ролей: баланс и возраст аккаунта"""
+        now = time.time() if now is None else now
+        min_points = self.min_points
+        created_before = now - self.account_age
+        result = []
+        for uid in user_ids:
+            if min_points and points(str(uid)) < min_points:
+                continue
+            if self.account_age and account_created(uid) > created_before:
+                continue
+            result.append(uid)
+        return result
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bulk role synchronization: rate limiting, worker pool, resumable state
+"""
+
+import os
+import json
+import time
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Iterable, Optional
+
+from storage import atomic_write_bytes, dump_compact
+
+
+class TokenBucket:
+    """Token bucket: at most `rate` requests per second, bursts of `burst`.
+
+    discord.py still handles 429s and per-route buckets itself; this keeps
+    bulk jobs from draining the shared bucket in the first place.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst,
+                                  self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class RoleSyncJob:
+    """Applies role updates for a list of users with a bounded worker pool.
+
+    apply(user_id) performs one update and returns True if something was
+    changed. Remaining user IDs are saved to state_path every
+    progress_interval seconds (and on cancellation), so a job interrupted
+    by a restart can be resumed from load().
+    """
+
+    def __init__(self,
+                 state_path: str,
+                 user_ids: Iterable[str],
+                 apply: Callable[[str], Awaitable[bool]],
+                 limiter: TokenBucket,
+                 workers: int = 4,
+                 meta: Optional[dict] = None,
+                 on_progress: Optional[Callable[["RoleSyncJob"],
+                                                Awaitable[None]]] = None,
+                 progress_interval: float = 5.0):
+        self.state_path = state_path
+        self.pending = deque(user_ids)
+        self.in_flight = set()
+        self.apply = apply
+        self.limiter = limiter
+        self.workers = workers
+        self.meta = meta or {}
+        self.on_progress = on_progress
+        self.progress_interval = progress_interval
+        self.total = len(self.pending)
+        self.done = 0
+        self.changed = 0
+        self.failed = 0
+
+    @staticmethod
+    def load(state_path: str) -> Optional[dict]:
+        """Состояние прерванной задачи или None"""
+        if not os.path.exists(state_path):
+            return None
+        try:
+            with open(state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error loading role sync state: {e}")
+            return None
+
+    def restore(self, state: dict):
+        """Продолжить счетчики из сохраненного состояния"""
+        self.total = state.get("total", self.total)
+        self.done = state.get("done", 0)
+        self.changed = state.get("changed", 0)
+        self.failed = state.get("failed", 0)
+
+    def save(self):
+        state = {
+            "meta": self.meta,
+            "pending": list(self.in_flight) + list(self.pending),
+            "total": self.total,
+            "done": self.done,
+            "changed": self.changed,
+            "failed": self.failed,
+        }
+        try:
+            atomic_write_bytes(self.state_path, dump_compact(state))
+        except Exception as e:
+            print(f"Error saving role sync state: {e}")
+
+    async def _worker(self):
+        while self.pending:
+            user_id = self.pending.popleft()
+            self.in_flight.add(user_id)
+            try:
+                await self.limiter.acquire()
+                if await self.apply(user_id):
+                    self.changed += 1
+            except asyncio.CancelledError:
+                self.in_flight.discard(user_id)
+                self.pending.appendleft(user_id)
+                raise
+            except Exception as e:
+                self.failed += 1
+                print(f"❌ Ошибка синхронизации ролей {user_id}: {e}")
+            self.in_flight.discard(user_id)
+            self.done += 1
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            self.save()
+            if self.on_progress is not None:
+                try:
+                    await self.on_progress(self)
+                except Exception as e:
+                    print(f"Error reporting role sync progress: {e}")
+
+    async def run(self):
+        self.save()
+        reporter = asyncio.create_task(self._report())
+        try:
+            await asyncio.gather(
+                *(self._worker() for _ in range(max(1, self.workers))))
+        except asyncio.CancelledError:
+            # Shutdown: keep what is left for the next start
+            self.save()
+            raise
+        finally:
+            reporter.cancel()
+
+        try:
+            os.unlink(self.state_path)
+        except OSError:
+            pass
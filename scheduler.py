@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Deadline scheduler shared by all timed events of the bot
+"""
+
+import time
+import heapq
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+
+class DeadlineScheduler:
+    """One task for any number of deadlines.
+
+    Deadlines (unix timestamps) live in a min-heap; the task sleeps exactly
+    until the earliest one and is woken early when something is scheduled.
+    Cancelled and rescheduled entries are dropped lazily when they reach the
+    top of the heap, so cancel() and schedule() are O(log n).
+
+    With max_running set at most that many callbacks run at once; a backlog
+    of overdue deadlines (after downtime) is worked off in deadline order
+    instead of all at the same moment.
+    """
+
+    def __init__(self,
+                 callback: Callable[[str], Awaitable[None]],
+                 max_running: int = 0):
+        self.callback = callback
+        self.max_running = max_running
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.deadlines: Dict[str, float] = {}
+        self._heap: List[Tuple[float, str]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+
+    def schedule(self, key: str, deadline: float):
+        """Запланировать (или перенести) событие"""
+        if self.deadlines.get(key) == deadline:
+            return
+        self.deadlines[key] = deadline
+        heapq.heappush(self._heap, (deadline, key))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def cancel(self, key: str):
+        if self.deadlines.pop(key, None) is None:
+            return
+        # Rebuild once stale entries dominate the heap
+        if len(self._heap) > 2 * len(self.deadlines) + 64:
+            self._heap = [(d, k) for k, d in self.deadlines.items()]
+            heapq.heapify(self._heap)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.deadlines
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
+
+    def overdue(self, now: Optional[float] = None) -> int:
+        """Сколько событий уже должно было сработать"""
+        now = time.time() if now is None else now
+        return sum(1 for deadline in self.deadlines.values()
+                   if deadline <= now)
+
+    def queue(self,
+              limit: Optional[int] = None,
+              prefix: str = "") -> List[Tuple[float, str]]:
+        """Ближайшие события (deadline, key) по возрастанию, только ключи
+        с prefix"""
+        entries = ((d, k) for k, d in self.deadlines.items()
+                   if k.startswith(prefix))
+        if limit is None:
+            return sorted(entries)
+        return heapq.nsmallest(limit, entries)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            if self.max_running > 0:
+                self._slots = asyncio.Semaphore(self.max_running)
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _drop_stale(self):
+        heap = self._heap
+        while heap and self.deadlines.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            self._drop_stale()
+
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            deadline, key = self._heap[0]
+            delay = deadline - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            if self._slots is not None:
+                await self._slots.acquire()
+                # Entries may have been cancelled while waiting for a slot
+                self._drop_stale()
+                if not self._heap or self._heap[0][0] > time.time():
+                    self._slots.release()
+                    continue
+                deadline, key = self._heap[0]
+
+            heapq.heappop(self._heap)
+            del self.deadlines[key]
+            self._fire(key)
+
+    def _fire(self, key: str):
+        task = asyncio.create_task(self._call(key))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _call(self, key: str):
+        try:
+            await self.callback(key)
+        except Exception as e:
+            print(f"Error in scheduled event {key}: {e}")
+        finally:
+            if self._slots is not None:
+                self._slots.release()
@@ -0,0 +1,1113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent storage for the giveaway bot
+
+Two interchangeable backends are available: JSON files (PointsStore,
+GiveawayStore) and SQLite (SqlitePointsStore, SqliteGiveawayStore).
+Both expose the same methods, main.py picks one via STORAGE_BACKEND.
+Data is partitioned by guild: GuildRegistry keeps one GuildData (its own
+directory with points, giveaways and archive) per guild.
+"""
+
+import os
+import re
+import sys
+import gzip
+import json
+import base64
+import bisect
+import random
+import sqlite3
+import asyncio
+import tempfile
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from indexes import LeaderboardIndex, ThresholdIndex
+from ledger import PointsLedger, SqlitePointsLedger
+from metrics import PERSIST_BYTES, PERSIST_SECONDS
+
+
+def atomic_write_bytes(path: str, payload: bytes):
+    """Записать файл атомарно: временный файл + rename"""
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-",
+                                    suffix=os.path.basename(path),
+                                    dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _json_default(obj):
+    if isinstance(obj, Participants):
+        return obj.encode()
+    raise TypeError(f"Object of type {type(obj).__name__} "
+                    "is not JSON serializable")
+
+
+def dump_json(data) -> str:
+    return json.dumps(data,
+                      ensure_ascii=False,
+                      separators=(",", ":"),
+                      default=_json_default)
+
+
+def dump_compact(data) -> bytes:
+    return dump_json(data).encode("utf-8")
+
+
+# ---------------- Participants ----------------
+class Participants:
+    """Ordered set of user IDs packed into a 64-bit array.
+
+    Membership and join are O(1): the array keeps join order and a dict
+    maps each ID to its slot. Leaving leaves a zero tombstone in the slot
+    (Discord IDs are never 0) and records the slot in a sorted list, so
+    list positions stay computable without touching the array; the array
+    is repacked once tombstones outnumber live entries. On disk the array is stored as little-endian
+    base64. version is bumped on every join and leave, so derived data
+    (rendered pages) can tell when it is stale.
+    """
+
+    __slots__ = ("_ids", "_slots", "_holes", "version")
+
+    def __init__(self, ids: Iterable = ()):
+        self._ids = array("Q")
+        self._slots: Dict[int, int] = {}
+        # Sorted slots of tombstones
+        self._holes: List[int] = []
+        self.version = 0
+        for uid in ids:
+            self.add(uid)
+
+    # --- encoding ---
+    def encode(self) -> str:
+        self._repack()
+        packed = self._ids
+        if sys.byteorder == "big":
+            packed = array("Q", packed)
+            packed.byteswap()
+        return "b64:" + base64.b64encode(packed.tobytes()).decode("ascii")
+
+    @classmethod
+    def decode(cls, value) -> "Participants":
+        """Принимает base64-строку или старый список строковых ID"""
+        if isinstance(value, Participants):
+            return value
+        if isinstance(value, str) and value.startswith("b64:"):
+            packed = array("Q")
+            packed.frombytes(base64.b64decode(value[4:]))
+            if sys.byteorder == "big":
+                packed.byteswap()
+            return cls(packed)
+        return cls(value or ())
+
+    # --- set operations ---
+    def __contains__(self, uid) -> bool:
+        return int(uid) in self._slots
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __bool__(self) -> bool:
+        return bool(self._slots)
+
+    def __iter__(self):
+        for uid in self._ids:
+            if uid:
+                yield uid
+
+    def add(self, uid) -> bool:
+        uid = int(uid)
+        if uid in self._slots:
+            return False
+        self._slots[uid] = len(self._ids)
+        self._ids.append(uid)
+        self.version += 1
+        return True
+
+    def discard(self, uid) -> bool:
+        slot = self._slots.pop(int(uid), None)
+        if slot is None:
+            return False
+        self._ids[slot] = 0
+        bisect.insort(self._holes, slot)
+        self.version += 1
+        if len(self._holes) > len(self._slots):
+            self._repack()
+        return True
+
+    def _repack(self):
+        if not self._holes:
+            return
+        self._ids = array("Q", (uid for uid in self._ids if uid))
+        self._slots = {uid: slot for slot, uid in enumerate(self._ids)}
+        self._holes = []
+
+    # --- reads ---
+    def _slot_of(self, position: int) -> int:
+        """Слот участника с номером position (с 0)"""
+        # holes[k] - k live entries precede the k-th tombstone
+        holes = self._holes
+        low, high = 0, len(holes)
+        while low < high:
+            mid = (low + high) // 2
+            if holes[mid] - mid <= position:
+                low = mid + 1
+            else:
+                high = mid
+        return position + low
+
+    def page(self, offset: int, count: int) -> List[int]:
+        """count участников начиная с номера offset (с 0)"""
+        if not self._holes:
+            return self._ids[offset:offset + count].tolist()
+        result = []
+        ids = self._ids
+        for slot in range(self._slot_of(offset), len(ids)):
+            if ids[slot]:
+                result.append(ids[slot])
+                if len(result) == count:
+                    break
+        return result
+
+    def position(self, uid) -> Optional[int]:
+        """Номер участника в порядке вступления (с 0) или None"""
+        slot = self._slots.get(int(uid))
+        if slot is None:
+            return None
+        return slot - bisect.bisect_left(self._holes, slot)
+
+    def sample(self, count: int) -> List[int]:
+        """Случайные count участников без повторов"""
+        self._repack()
+        if count >= len(self._ids):
+            return list(self._ids)
+        return random.sample(self._ids, count)
+
+
+def participants_of(giveaway: dict) -> Participants:
+    """Участники розыгрыша (старые списки превращаются в Participants)"""
+    participants = giveaway.get('participants')
+    if not isinstance(participants, Participants):
+        participants = Participants.decode(participants)
+        giveaway['participants'] = participants
+    return participants
+
+
+# ---------------- Points ----------------
+class PointsStore:
+    """In-memory points storage with write-behind flushing.
+
+    The file is parsed once in load(); reads are served from memory, writes
+    only mark the store dirty and a background flusher persists the whole
+    snapshot at most once per flush_interval seconds. Listeners are called
+    with (user_id, points) after every balance change.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 5.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.users: Dict[str, int] = {}
+        self.role_rewards: Dict[str, int] = {}
+        self.leaderboard = LeaderboardIndex()
+        self.rewards_index = ThresholdIndex()
+        self.listeners: List[Callable[[str, int], None]] = []
+        self.dirty = False
+        self._dirty_event: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+
+    def load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            else:
+                data = {}
+        except Exception as e:
+            print(f"Error loading points: {e}")
+            data = {}
+
+        self.users = {
+            str(uid): int(points)
+            for uid, points in data.get("users", {}).items()
+        }
+        self.role_rewards = {
+            str(rid): int(threshold)
+            for rid, threshold in data.get("role_rewards", {}).items()
+        }
+        self.leaderboard.rebuild(self.users.items())
+        self.rewards_index.rebuild(self.role_rewards)
+        self.dirty = False
+
+    def snapshot(self) -> dict:
+        return {"users": self.users, "role_rewards": self.role_rewards}
+
+    # --- reads ---
+    def get(self, user_id: str) -> int:
+        return self.users.get(user_id, 0)
+
+    def top(self, limit: int = 10, offset: int = 0) -> List[Tuple[str, int]]:
+        return self.leaderboard.top(limit, offset)
+
+    def rank(self, user_id: str) -> Optional[int]:
+        if user_id not in self.users:
+            return None
+        return self.leaderboard.rank(user_id, self.users[user_id])
+
+    # --- writes ---
+    def set(self, user_id: str, points: int) -> int:
+        points = max(0, int(points))
+        self.leaderboard.update(user_id, self.users.get(user_id), points)
+        self.users[user_id] = points
+        self.mark_dirty()
+        for listener in self.listeners:
+            listener(user_id, points)
+        return points
+
+    def add(self, user_id: str, delta: int) -> int:
+        return self.set(user_id, self.get(user_id) + delta)
+
+    def add_many(self, deltas: Dict[str, int]) -> Dict[str, int]:
+        """Применить изменения пачкой, вернуть новые балансы"""
+        return {
+            user_id: self.add(user_id, delta)
+            for user_id, delta in deltas.items()
+        }
+
+    def set_reward(self, role_id: str, threshold: int):
+        self.role_rewards[role_id] = int(threshold)
+        self.rewards_index.rebuild(self.role_rewards)
+        self.mark_dirty()
+
+    def mark_dirty(self):
+        self.dirty = True
+        if self._dirty_event is not None:
+            self._dirty_event.set()
+
+    # --- persistence ---
+    def flush(self):
+        """Синхронно сохранить, если есть изменения (для shutdown)"""
+        if not self.dirty:
+            return
+        self.dirty = False
+        try:
+            with PERSIST_SECONDS.time(op="points_flush"):
+                payload = dump_compact(self.snapshot())
+                atomic_write_bytes(self.path, payload)
+            PERSIST_BYTES.inc(len(payload), op="points_flush")
+        except Exception as e:
+            self.dirty = True
+            print(f"Error saving points: {e}")
+
+    async def flush_async(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+        # Serialize on the loop so the dict can't change mid-dump,
+        # the disk write itself goes to a worker thread
+        try:
+            with PERSIST_SECONDS.time(op="points_flush"):
+                payload = dump_compact(self.snapshot())
+                await asyncio.to_thread(atomic_write_bytes, self.path,
+                                        payload)
+            PERSIST_BYTES.inc(len(payload), op="points_flush")
+        except Exception as e:
+            self.mark_dirty()
+            print(f"Error saving points: {e}")
+
+    def start(self):
+        if self._flusher is None or self._flusher.done():
+            self._dirty_event = asyncio.Event()
+            if self.dirty:
+                self._dirty_event.set()
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await self._dirty_event.wait()
+            # Debounce: give other writes a chance to pile up
+            await asyncio.sleep(self.flush_interval)
+            self._dirty_event.clear()
+            await self.flush_async()
+
+    async def stop(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush_async()
+
+
+# ---------------- Giveaways ----------------
+class GiveawayStore:
+    """Giveaways kept in memory, persisted as snapshot + append-only journal.
+
+    Every change is appended to the journal as one compact JSON line, so the
+    cost of a join/leave does not depend on how much data there is. On load
+    the journal is replayed over the last snapshot; compact() folds it into a
+    new snapshot in the background. All records are idempotent, so replaying
+    a journal over a snapshot that already contains it is harmless.
+    """
+
+    def __init__(self,
+                 path: str,
+                 compact_interval: float = 300.0,
+                 compact_min_records: int = 1000):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.compacting_path = path + ".journal.compacting"
+        self.compact_interval = compact_interval
+        self.compact_min_records = compact_min_records
+        self.giveaways: Dict[str, dict] = {}
+        self.records_since_compact = 0
+        self.loaded = False
+        self._journal = None
+        self._compactor: Optional[asyncio.Task] = None
+        self._compact_lock: Optional[asyncio.Lock] = None
+
+    # --- loading ---
+    def load(self, writable: bool = True):
+        """Прочитать снимок и журнал; writable=False - только чтение
+        (no journal is opened or created, compact() writes nothing)"""
+        self.close()
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            else:
+                data = {}
+        except Exception as e:
+            print(f"Error loading data: {e}")
+            data = {}
+
+        # Mutate in place so module-level references stay valid
+        self.giveaways.clear()
+        self.giveaways.update(data)
+        for giveaway in self.giveaways.values():
+            participants_of(giveaway)
+
+        replayed = 0
+        for journal in (self.compacting_path, self.journal_path):
+            replayed += self._replay(journal)
+        self.records_since_compact = replayed
+
+        if writable:
+            self._journal = open(self.journal_path, "a", encoding="utf-8")
+            self.loaded = True
+
+    def _replay(self, path: str) -> int:
+        if not os.path.exists(path):
+            return 0
+        count = 0
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn last line after a crash
+                    print(f"Skipping broken journal record in {path}")
+                    continue
+                self._apply(record)
+                count += 1
+        return count
+
+    def _apply(self, record: dict):
+        op = record.get("op")
+        giveaway_id = record.get("id")
+
+        if op == "create":
+            self.giveaways[giveaway_id] = record["data"]
+            participants_of(record["data"])
+            return
+        if op == "delete":
+            self.giveaways.pop(giveaway_id, None)
+            return
+
+        giveaway = self.giveaways.get(giveaway_id)
+        if giveaway is None:
+            return
+
+        if op == "join":
+            participants_of(giveaway).add(record["user"])
+        elif op == "leave":
+            participants_of(giveaway).discard(record["user"])
+        elif op == "update":
+            giveaway.update(record["fields"])
+
+    # --- writes ---
+    def _append(self, record: dict):
+        if self._journal is None:
+            self._journal = open(self.journal_path, "a", encoding="utf-8")
+        try:
+            with PERSIST_SECONDS.time(op="journal_append"):
+                line = dump_json(record) + "\n"
+                self._journal.write(line)
+                self._journal.flush()
+            PERSIST_BYTES.inc(len(line), op="journal_append")
+        except Exception as e:
+            print(f"Error saving data: {e}")
+        self.records_since_compact += 1
+
+    def create(self, giveaway_id: str, data: dict):
+        participants_of(data)
+        self.giveaways[giveaway_id] = data
+        self._append({"op": "create", "id": giveaway_id, "data": data})
+
+    def join(self, giveaway_id: str, user_id: str):
+        participants_of(self.giveaways[giveaway_id]).add(user_id)
+        self._append({"op": "join", "id": giveaway_id, "user": int(user_id)})
+
+    def leave(self, giveaway_id: str, user_id: str):
+        participants_of(self.giveaways[giveaway_id]).discard(user_id)
+        self._append({"op": "leave", "id": giveaway_id, "user": int(user_id)})
+
+    def update(self, giveaway_id: str, **fields):
+        self.giveaways[giveaway_id].update(fields)
+        self._append({"op": "update", "id": giveaway_id, "fields": fields})
+
+    def delete(self, giveaway_id: str):
+        self.giveaways.pop(giveaway_id, None)
+        self._append({"op": "delete", "id": giveaway_id})
+
+    # --- compaction ---
+    def _rotate(self) -> bytes:
+        """Начать компакцию: снимок состояния и новый журнал"""
+        payload = dump_compact(self.giveaways)
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        # A leftover .compacting file means the previous compaction failed;
+        # keep it and just continue the current journal in that case
+        if not os.path.exists(self.compacting_path) and os.path.exists(
+                self.journal_path):
+            os.replace(self.journal_path, self.compacting_path)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self.records_since_compact = 0
+        return payload
+
+    def _write_snapshot(self, payload: bytes):
+        atomic_write_bytes(self.path, payload)
+        if os.path.exists(self.compacting_path):
+            os.unlink(self.compacting_path)
+        PERSIST_BYTES.inc(len(payload), op="giveaway_compact")
+
+    def compact(self):
+        """Синхронная компакция (для shutdown)"""
+        # Never overwrite the snapshot with state that was never loaded
+        if not self.loaded:
+            return
+        try:
+            with PERSIST_SECONDS.time(op="giveaway_compact"):
+                self._write_snapshot(self._rotate())
+        except Exception as e:
+            print(f"Error compacting data: {e}")
+
+    async def compact_async(self):
+        if self._compact_lock is None:
+            self._compact_lock = asyncio.Lock()
+        if not self.loaded:
+            return
+        async with self._compact_lock:
+            try:
+                with PERSIST_SECONDS.time(op="giveaway_compact"):
+                    payload = self._rotate()
+                    await asyncio.to_thread(self._write_snapshot, payload)
+            except Exception as e:
+                print(f"Error compacting data: {e}")
+
+    def start(self):
+        if self._compactor is None or self._compactor.done():
+            self._compactor = asyncio.create_task(self._compact_loop())
+
+    async def _compact_loop(self):
+        while True:
+            await asyncio.sleep(self.compact_interval)
+            if self.records_since_compact >= self.compact_min_records:
+                await self.compact_async()
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+
+# ---------------- Archive ----------------
+class GiveawayArchive:
+    """Cold storage for ended giveaways: one gzip'ed JSON file per giveaway.
+
+    Files are only read when a giveaway is requested by ID; the last few
+    loaded giveaways are kept in a small LRU cache. put() and get() run in
+    worker threads as well as on the loop, the cache is guarded by a lock.
+    """
+
+    ID_RE = re.compile(r"^[\w-]+$")
+
+    def __init__(self, directory: str, cache_size: int = 32):
+        self.directory = directory
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, giveaway_id: str) -> Optional[str]:
+        # IDs come from user commands, never let them escape the directory
+        if not self.ID_RE.match(giveaway_id):
+            return None
+        return os.path.join(self.directory, f"{giveaway_id}.json.gz")
+
+    def __contains__(self, giveaway_id: str) -> bool:
+        path = self.path(giveaway_id)
+        return path is not None and os.path.exists(path)
+
+    def put(self, giveaway_id: str, payload: bytes):
+        """Сохранить сериализованный розыгрыш (вызывается из потока)"""
+        with PERSIST_SECONDS.time(op="archive_put"):
+            compressed = gzip.compress(payload)
+            atomic_write_bytes(self.path(giveaway_id), compressed)
+        PERSIST_BYTES.inc(len(compressed), op="archive_put")
+        with self._lock:
+            self._cache.pop(giveaway_id, None)
+
+    def get(self, giveaway_id: str) -> Optional[dict]:
+        with self._lock:
+            giveaway = self._cache.get(giveaway_id)
+            if giveaway is not None:
+                self._cache.move_to_end(giveaway_id)
+                return giveaway
+
+        path = self.path(giveaway_id)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            with gzip.open(path, "rb") as f:
+                giveaway = json.loads(f.read().decode("utf-8"))
+        except Exception as e:
+            print(f"Error loading archived giveaway {giveaway_id}: {e}")
+            return None
+        participants_of(giveaway)
+
+        with self._lock:
+            self._cache[giveaway_id] = giveaway
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return giveaway
+
+
+# ---------------- SQLite ----------------
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    points INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_users_points ON users (points DESC);
+
+CREATE TABLE IF NOT EXISTS role_rewards (
+    role_id TEXT PRIMARY KEY,
+    threshold INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS giveaways (
+    id TEXT PRIMARY KEY,
+    end_time INTEGER NOT NULL DEFAULT 0,
+    ended INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_giveaways_open ON giveaways (ended, end_time);
+
+CREATE TABLE IF NOT EXISTS participants (
+    giveaway_id TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    PRIMARY KEY (giveaway_id, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS ledger (
+    id INTEGER PRIMARY KEY,
+    ts INTEGER NOT NULL,
+    actor TEXT,
+    target TEXT NOT NULL,
+    delta INTEGER NOT NULL,
+    reason TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_ledger_ts ON ledger (ts);
+"""
+
+
+def open_sqlite(path: str) -> sqlite3.Connection:
+    """Открыть базу в режиме WAL и создать схему"""
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SQLITE_SCHEMA)
+    return conn
+
+
+class SqlitePointsStore:
+    """Points in SQLite: single-row upserts.
+
+    Balances and the leaderboard are also kept in memory so hot reads never
+    touch the disk. Listeners work as in PointsStore.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.users: Dict[str, int] = {}
+        self.role_rewards: Dict[str, int] = {}
+        self.leaderboard = LeaderboardIndex()
+        self.rewards_index = ThresholdIndex()
+        self.listeners: List[Callable[[str, int], None]] = []
+
+    def load(self):
+        self.users = dict(self.conn.execute("SELECT user_id, points FROM users"))
+        self.role_rewards = dict(
+            self.conn.execute("SELECT role_id, threshold FROM role_rewards"))
+        self.leaderboard.rebuild(self.users.items())
+        self.rewards_index.rebuild(self.role_rewards)
+
+    def snapshot(self) -> dict:
+        return {"users": self.users, "role_rewards": self.role_rewards}
+
+    # --- reads ---
+    def get(self, user_id: str) -> int:
+        return self.users.get(user_id, 0)
+
+    def top(self, limit: int = 10, offset: int = 0) -> List[Tuple[str, int]]:
+        return self.leaderboard.top(limit, offset)
+
+    def rank(self, user_id: str) -> Optional[int]:
+        if user_id not in self.users:
+            return None
+        return self.leaderboard.rank(user_id, self.users[user_id])
+
+    # --- writes ---
+    def set(self, user_id: str, points: int) -> int:
+        points = max(0, int(points))
+        self.leaderboard.update(user_id, self.users.get(user_id), points)
+        self.users[user_id] = points
+        with PERSIST_SECONDS.time(op="sqlite_points"):
+            self.conn.execute(
+                "INSERT INTO users (user_id, points) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET points = excluded.points",
+                (user_id, points))
+        for listener in self.listeners:
+            listener(user_id, points)
+        return points
+
+    def add(self, user_id: str, delta: int) -> int:
+        return self.set(user_id, self.get(user_id) + delta)
+
+    def add_many(self, deltas: Dict[str, int]) -> Dict[str, int]:
+        """Применить изменения одной транзакцией, вернуть новые балансы"""
+        balances = {
+            user_id: max(0, self.get(user_id) + int(delta))
+            for user_id, delta in deltas.items()
+        }
+        with PERSIST_SECONDS.time(op="sqlite_points"), self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "INSERT INTO users (user_id, points) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET points = excluded.points",
+                balances.items())
+        for user_id, points in balances.items():
+            self.leaderboard.update(user_id, self.users.get(user_id), points)
+            self.users[user_id] = points
+            for listener in self.listeners:
+                listener(user_id, points)
+        return balances
+
+    def set_reward(self, role_id: str, threshold: int):
+        self.role_rewards[role_id] = int(threshold)
+        self.rewards_index.rebuild(self.role_rewards)
+        self.conn.execute(
+            "INSERT INTO role_rewards (role_id, threshold) VALUES (?, ?) "
+            "ON CONFLICT(role_id) DO UPDATE SET threshold = excluded.threshold",
+            (role_id, int(threshold)))
+
+    # --- persistence (every write is already committed) ---
+    def flush(self):
+        pass
+
+    async def flush_async(self):
+        pass
+
+    def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class SqliteGiveawayStore:
+    """Giveaways in SQLite: one row per giveaway, one row per participant"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.giveaways: Dict[str, dict] = {}
+        self.loaded = False
+
+    def load(self):
+        self.giveaways.clear()
+        for giveaway_id, data in self.conn.execute(
+                "SELECT id, data FROM giveaways"):
+            giveaway = json.loads(data)
+            giveaway['participants'] = Participants()
+            self.giveaways[giveaway_id] = giveaway
+
+        for giveaway_id, user_id in self.conn.execute(
+                "SELECT giveaway_id, user_id FROM participants ORDER BY rowid"):
+            giveaway = self.giveaways.get(giveaway_id)
+            if giveaway is not None:
+                giveaway['participants'].add(user_id)
+        self.loaded = True
+
+    def _write_row(self, giveaway_id: str):
+        giveaway = self.giveaways[giveaway_id]
+        data = {k: v for k, v in giveaway.items() if k != 'participants'}
+        with PERSIST_SECONDS.time(op="sqlite_giveaways"):
+            self.conn.execute(
+                "INSERT INTO giveaways (id, end_time, ended, data) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET "
+                "end_time = excluded.end_time, ended = excluded.ended, "
+                "data = excluded.data",
+                (giveaway_id, int(giveaway.get('end_time', 0)),
+                 int(bool(giveaway.get('ended'))), dump_json(data)))
+
+    # --- writes ---
+    def create(self, giveaway_id: str, data: dict):
+        participants = participants_of(data)
+        self.giveaways[giveaway_id] = data
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self._write_row(giveaway_id)
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO participants (giveaway_id, user_id) "
+                "VALUES (?, ?)", [(giveaway_id, uid) for uid in participants])
+
+    def join(self, giveaway_id: str, user_id: str):
+        participants_of(self.giveaways[giveaway_id]).add(user_id)
+        with PERSIST_SECONDS.time(op="sqlite_giveaways"):
+            self.conn.execute(
+                "INSERT OR IGNORE INTO participants (giveaway_id, user_id) "
+                "VALUES (?, ?)", (giveaway_id, int(user_id)))
+
+    def leave(self, giveaway_id: str, user_id: str):
+        participants_of(self.giveaways[giveaway_id]).discard(user_id)
+        with PERSIST_SECONDS.time(op="sqlite_giveaways"):
+            self.conn.execute(
+                "DELETE FROM participants WHERE giveaway_id = ? AND user_id = ?",
+                (giveaway_id, int(user_id)))
+
+    def update(self, giveaway_id: str, **fields):
+        self.giveaways[giveaway_id].update(fields)
+        self._write_row(giveaway_id)
+
+    def delete(self, giveaway_id: str):
+        self.giveaways.pop(giveaway_id, None)
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.execute("DELETE FROM giveaways WHERE id = ?",
+                              (giveaway_id, ))
+            self.conn.execute(
+                "DELETE FROM participants WHERE giveaway_id = ?",
+                (giveaway_id, ))
+
+    # --- persistence ---
+    def compact(self):
+        if self.loaded:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    async def compact_async(self):
+        self.compact()
+
+    def start(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# ---------------- Guilds ----------------
+class ScheduleStore:
+    """Giveaway schedules of one guild (schedules.json, both backends).
+
+    A handful of small definitions that change about once per run, so the
+    whole file is rewritten atomically on every change.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.schedules: Dict[str, dict] = {}
+
+    def load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.schedules = json.load(f)
+        except Exception as e:
+            print(f"Error loading schedules: {e}")
+            self.schedules = {}
+
+    def save(self):
+        payload = dump_compact(self.schedules)
+        try:
+            with PERSIST_SECONDS.time(op="schedules"):
+                atomic_write_bytes(self.path, payload)
+            PERSIST_BYTES.inc(len(payload), op="schedules")
+        except Exception as e:
+            print(f"Error saving schedules: {e}")
+
+    def put(self, schedule_id: str, schedule: dict):
+        self.schedules[schedule_id] = schedule
+        self.save()
+
+    def update(self, schedule_id: str, **fields):
+        if schedule_id in self.schedules:
+            self.schedules[schedule_id].update(fields)
+            self.save()
+
+    def delete(self, schedule_id: str) -> bool:
+        if self.schedules.pop(schedule_id, None) is None:
+            return False
+        self.save()
+        return True
+
+
+class GuildData:
+    """Points (with their ledger), giveaways and archive of one guild.
+
+    Every guild has its own directory (JSON files or its own SQLite
+    database), so loading, flushing and compacting one guild never touches
+    the data of another.
+    """
+
+    def __init__(self,
+                 guild_id: int,
+                 directory: str,
+                 backend: str = "json",
+                 flush_interval: float = 5.0,
+                 compact_interval: float = 300.0,
+                 ledger_windows: Optional[Dict[str, int]] = None):
+        self.guild_id = guild_id
+        self.directory = directory
+        self.conn: Optional[sqlite3.Connection] = None
+        os.makedirs(directory, exist_ok=True)
+
+        if backend == "sqlite":
+            self.conn = open_sqlite(os.path.join(directory, "bot.db"))
+            self.giveaway_store = SqliteGiveawayStore(self.conn)
+            self.points = SqlitePointsStore(self.conn)
+            self.ledger = SqlitePointsLedger(self.conn, ledger_windows)
+        else:
+            self.giveaway_store = GiveawayStore(
+                os.path.join(directory, "giveaways.json"),
+                compact_interval=compact_interval)
+            self.points = PointsStore(os.path.join(directory, "points.json"),
+                                      flush_interval=flush_interval)
+            self.ledger = PointsLedger(os.path.join(directory, "ledger"),
+                                       ledger_windows)
+
+        self.giveaways = self.giveaway_store.giveaways
+        self.archive = GiveawayArchive(os.path.join(directory, "archive"))
+        self.schedules = ScheduleStore(
+            os.path.join(directory, "schedules.json"))
+
+    def load(self):
+        self.points.load()
+        self.ledger.load()
+        self.giveaway_store.load()
+        self.schedules.load()
+
+    def start(self):
+        self.points.start()
+        self.giveaway_store.start()
+
+    def close(self):
+        """Сохранить все и закрыть (для shutdown)"""
+        self.points.flush()
+        self.giveaway_store.compact()
+        self.giveaway_store.close()
+        self.ledger.close()
+        if self.conn is not None:
+            self.conn.close()
+
+
+class GuildRegistry:
+    """GuildData per guild ID, opened and loaded on first access"""
+
+    def __init__(self, root: str, **options):
+        self.root = root
+        self.options = options
+        self.guilds: Dict[int, GuildData] = {}
+        self.started = False
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, guild_id) -> str:
+        return os.path.join(self.root, str(int(guild_id)))
+
+    def get(self, guild_id) -> GuildData:
+        guild_id = int(guild_id)
+        data = self.guilds.get(guild_id)
+        if data is None:
+            data = GuildData(guild_id, self.path(guild_id), **self.options)
+            data.load()
+            if self.started:
+                data.start()
+            self.guilds[guild_id] = data
+        return data
+
+    def load_existing(self) -> int:
+        """Открыть все серверы, у которых уже есть каталог данных"""
+        for name in os.listdir(self.root):
+            if name.isdigit() and os.path.isdir(os.path.join(self.root, name)):
+                self.get(name)
+        return len(self.guilds)
+
+    def __contains__(self, guild_id) -> bool:
+        return int(guild_id) in self.guilds
+
+    def __iter__(self):
+        return iter(list(self.guilds.values()))
+
+    def __len__(self) -> int:
+        return len(self.guilds)
+
+    def start(self):
+        """Запустить фоновые задачи уже открытых и всех будущих серверов"""
+        self.started = True
+        for data in self:
+            data.start()
+
+    def close(self):
+        for data in self:
+            data.close()
+
+
+# Files of the old single-guild layout, directly in DATA_DIR
+FLAT_DATA_FILES = ("points.json", "giveaways.json", "giveaways.json.journal",
+                   "giveaways.json.journal.compacting", "bot.db", "bot.db-wal",
+                   "bot.db-shm", "archive")
+
+
+def has_flat_data(data_dir: str) -> bool:
+    return any(
+        os.path.exists(os.path.join(data_dir, name))
+        for name in ("points.json", "giveaways.json", "bot.db"))
+
+
+def _empty_value(value) -> bool:
+    if isinstance(value, dict):
+        return all(map(_empty_value, value.values()))
+    return isinstance(value, list) and not value
+
+
+def _is_empty_store(path: str) -> bool:
+    """Файл хранилища, который создан при старте, но без данных"""
+    if os.path.isdir(path):
+        return not os.listdir(path)
+    if path.endswith(("-wal", "-shm")):
+        # Belong to the database next to them
+        database = path[:-4]
+        if os.path.exists(database):
+            return _is_empty_store(database)
+    if os.path.getsize(path) == 0:
+        return True
+    if path.endswith(".json"):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return _empty_value(json.load(f))
+        except ValueError:
+            return False
+    if path.endswith(".db"):
+        try:
+            conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        except sqlite3.Error:
+            return False
+        try:
+            tables = [
+                row[0] for row in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table'")
+            ]
+            return not any(
+                conn.execute(f'SELECT 1 FROM "{table}" LIMIT 1').fetchone()
+                for table in tables)
+        except sqlite3.Error:
+            return False
+        finally:
+            conn.close()
+    return False
+
+
+def migrate_flat_data(data_dir: str, guild_dir: str) -> List[str]:
+    """Перенести общие данные старого формата в каталог одного сервера.
+
+    Store files the guild already has may only be empty ones (created by a
+    start before the migration), they are replaced.
+    """
+    os.makedirs(guild_dir, exist_ok=True)
+
+    # Never mix the old data into a guild that already has its own
+    for name in FLAT_DATA_FILES:
+        target = os.path.join(guild_dir, name)
+        if os.path.exists(target) and not _is_empty_store(target):
+            raise FileExistsError(target)
+    # A leftover journal or WAL would be replayed onto the moved data
+    for name in FLAT_DATA_FILES:
+        target = os.path.join(guild_dir, name)
+        if os.path.isfile(target):
+            os.remove(target)
+
+    moved = []
+    for name in FLAT_DATA_FILES:
+        source = os.path.join(data_dir, name)
+        target = os.path.join(guild_dir, name)
+        if not os.path.exists(source):
+            continue
+        if os.path.isdir(source) and os.path.isdir(target):
+            for entry in os.listdir(source):
+                os.replace(os.path.join(source, entry),
+                           os.path.join(target, entry))
+            os.rmdir(source)
+        else:
+            os.replace(source, target)
+        moved.append(name)
+    return moved
+
+
+def import_json(conn: sqlite3.Connection, giveaways_path: str,
+                points_path: str) -> Tuple[int, int]:
+    """Импорт giveaways.json (+ журнал) и points.json в SQLite"""
+    json_points = PointsStore(points_path)
+    json_points.load()
+    # Read only: the source directory must not gain store files
+    json_giveaways = GiveawayStore(giveaways_path)
+    json_giveaways.load(writable=False)
+
+    with conn:
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT OR REPLACE INTO users (user_id, points) VALUES (?, ?)",
+            json_points.users.items())
+        conn.executemany(
+            "INSERT OR REPLACE INTO role_rewards (role_id, threshold) "
+            "VALUES (?, ?)", json_points.role_rewards.items())
+
+    sqlite_giveaways = SqliteGiveawayStore(conn)
+    for giveaway_id, giveaway in json_giveaways.giveaways.items():
+        sqlite_giveaways.create(giveaway_id, giveaway)
+
+    return len(json_points.users), len(json_giveaways.giveaways)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Points for time spent in voice channels
+"""
+
+import os
+import json
+from typing import Dict, Iterable, Tuple
+
+from metrics import PERSIST_BYTES
+from storage import atomic_write_bytes, dump_compact
+
+
+class VoiceTracker:
+    """Open voice sessions and time not yet converted into points.
+
+    Sessions only live in memory between ticks; tick() credits the time of
+    every open session at once, turns full seconds_per_point periods into
+    points (the remainder carries over) and the caller persists the state
+    with save(). After a restart load() + reconcile() pick up sessions of
+    members that are still in voice.
+    """
+
+    def __init__(self, path: str, seconds_per_point: float, points: int = 1):
+        self.path = path
+        self.seconds_per_point = seconds_per_point
+        self.points = points
+        # (guild_id, user_id) -> time credited up to
+        self.sessions: Dict[Tuple[int, int], float] = {}
+        # (guild_id, user_id) -> seconds not worth a point yet
+        self.carry: Dict[Tuple[int, int], float] = {}
+        # Sessions from the last run, waiting for reconcile()
+        self.restored: Dict[Tuple[int, int], float] = {}
+
+    # --- persistence ---
+    @staticmethod
+    def _encode(values: Dict[Tuple[int, int], float]) -> dict:
+        return {f"{g}:{u}": value for (g, u), value in values.items()}
+
+    @staticmethod
+    def _decode(values: dict) -> Dict[Tuple[int, int], float]:
+        result = {}
+        for key, value in values.items():
+            guild_id, user_id = key.split(":")
+            result[(int(guild_id), int(user_id))] = float(value)
+        return result
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            self.restored = self._decode(state.get("sessions", {}))
+            self.carry = self._decode(state.get("carry", {}))
+        except Exception as e:
+            print(f"Error loading voice sessions: {e}")
+
+    def snapshot(self) -> bytes:
+        return dump_compact({
+            "sessions": self._encode(self.sessions),
+            "carry": self._encode(self.carry)
+        })
+
+    def save(self, payload: bytes):
+        """Записать снимок (вызывается из потока)"""
+        atomic_write_bytes(self.path, payload)
+        PERSIST_BYTES.inc(len(payload), op="voice_sessions")
+
+    # --- sessions ---
+    def _credit(self, key: Tuple[int, int], seconds: float):
+        if seconds > 0:
+            self.carry[key] = self.carry.get(key, 0.0) + seconds
+
+    def start(self, guild_id: int, user_id: int, now: float):
+        self.sessions.setdefault((guild_id, user_id), now)
+
+    def stop(self, guild_id: int, user_id: int, now: float):
+        since = self.sessions.pop((guild_id, user_id), None)
+        if since is not None:
+            self._credit((guild_id, user_id), now - since)
+
+    def update(self, guild_id: int, user_id: int, eligible: bool,
+               now: float):
+        """Новое голосовое состояние участника"""
+        if eligible:
+            self.start(guild_id, user_id, now)
+        else:
+            self.stop(guild_id, user_id, now)
+
+    def reconcile(self, guild_id: int, present: Iterable[int], now: float,
+                  max_gap: float):
+        """Сверить сессии сервера с теми, кто сейчас в голосе.
+
+        Restored sessions of members still in voice continue from their
+        persisted time if the bot was away for at most max_gap seconds;
+        tracked members that are gone are stopped.
+        """
+        present = set(present)
+        for user_id in present:
+            key = (guild_id, user_id)
+            since = self.restored.pop(key, None)
+            if key in self.sessions:
+                continue
+            if since is not None and now - since <= max_gap:
+                self.sessions[key] = since
+            else:
+                self.sessions[key] = now
+
+        for key in [key for key in self.sessions
+                    if key[0] == guild_id and key[1] not in present]:
+            self.stop(key[0], key[1], now)
+        for key in [key for key in self.restored if key[0] == guild_id]:
+            del self.restored[key]
+
+    def tick(self, now: float) -> Dict[int, Dict[str, int]]:
+        """Начислить время всех сессий, вернуть {guild_id: {user_id: очки}}"""
+        for key, since in self.sessions.items():
+            self._credit(key, now - since)
+            self.sessions[key] = now
+
+        batches: Dict[int, Dict[str, int]] = {}
+        for key, seconds in list(self.carry.items()):
+            periods = int(seconds // self.seconds_per_point)
+            if periods:
+                guild_id, user_id = key
+                batches.setdefault(guild_id, {})[str(user_id)] = (
+                    periods * self.points)
+                seconds -= periods * self.seconds_per_point
+            if seconds > 0 or key in self.sessions:
+                self.carry[key] = seconds
+            else:
+                del self.carry[key]
+        return batches